@@ -0,0 +1,275 @@
+"""
+A synthetic DNS hierarchy served on loopback addresses, so TrustTrees can
+be benchmarked without touching the real internet.
+
+    root servers             127.1.0.{1..3}    {a,b,c}.root-servers.net.
+    TLD servers of tld{j}.   127.2.{j}.{k}     ns{k}.nic.tld{j}.
+    hosting providers        127.3.{p}.{k}     ns{k}.provider{p}.tld0.
+    recursive resolver       127.0.9.53
+
+Domains are named d{m}.tld{j}. and delegated to one hosting provider
+each. A `glueless_fraction` of them use the provider's own nameserver
+hostnames, which get no glue in the TLD referral. The rest use
+nameservers under the domain itself, e.g. ns0.d3.tld1., which the TLD
+referral has glue for, served from the same provider addresses.
+
+Every address is a separate socket, which needs Linux (where all of
+127.0.0.0/8 is loopback) and, on port 53, root. Pass another port and
+`--dns-port` to TrustTrees otherwise.
+
+    python benchmarks/fake_dns.py --port 5300 --latency 0.005
+"""
+import argparse
+import asyncio
+import random
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+TTL = 3600
+RESOLVER_IP = '127.0.9.53'
+
+
+class Hierarchy:
+    def __init__(
+        self,
+        tlds=2,
+        tld_nameservers=4,
+        domains_per_tld=1000,
+        providers=8,
+        provider_nameservers=4,
+        glueless_fraction=0.5,
+    ):
+        # Hostname to IP
+        self.a_records = {}
+        # Zone to list of (nameserver hostname, IP)
+        self.delegations = {}
+        # Nameserver IP to zones it is authoritative for
+        self.zones_by_ip = {}
+
+        self.root_servers = [
+            (f'{letter}.root-servers.net.', f'127.1.0.{i + 1}')
+            for i, letter in enumerate('abc')
+        ]
+        self._add_delegation('.', self.root_servers)
+
+        provider_ips = [
+            [f'127.3.{p}.{k + 1}' for k in range(provider_nameservers)]
+            for p in range(providers)
+        ]
+        for p, ips in enumerate(provider_ips):
+            for k, ip in enumerate(ips):
+                self.a_records[f'ns{k}.provider{p}.tld0.'] = ip
+                self.zones_by_ip.setdefault(ip, set())
+
+        for j in range(tlds):
+            tld = f'tld{j}.'
+            self._add_delegation(
+                tld,
+                [(f'ns{k}.nic.{tld}', f'127.2.{j}.{k + 1}') for k in range(tld_nameservers)],
+            )
+            for m in range(domains_per_tld):
+                domain = f'd{m}.{tld}'
+                p = m % providers
+                if random.random() < glueless_fraction:
+                    nameservers = [
+                        (f'ns{k}.provider{p}.tld0.', ip)
+                        for k, ip in enumerate(provider_ips[p])
+                    ]
+                else:
+                    nameservers = [
+                        (f'ns{k}.{domain}', ip)
+                        for k, ip in enumerate(provider_ips[p])
+                    ]
+                self._add_delegation(domain, nameservers)
+
+    def _add_delegation(self, zone, nameservers):
+        self.delegations[zone] = nameservers
+        for hostname, ip in nameservers:
+            self.a_records[hostname] = ip
+            self.zones_by_ip.setdefault(ip, set()).add(zone)
+
+    def get_domains(self):
+        return [
+            zone
+            for zone in self.delegations
+            if zone.count('.') == 2
+        ]
+
+    def _find_zone(self, ip, qname):
+        """
+        :returns: the deepest zone `ip` serves that `qname` is under
+        """
+        name = qname
+        while True:
+            zone = name.to_text().lower()
+            if zone in self.zones_by_ip[ip]:
+                return zone
+            if name == dns.name.root:
+                return None
+            name = name.parent()
+
+    def _find_child_zone(self, zone, qname):
+        """
+        :returns: the zone delegated from `zone` that `qname` is under
+        """
+        labels = qname.labels
+        child_labels = len(dns.name.from_text(zone).labels) + 1
+        if len(labels) < child_labels:
+            return None
+        child_zone = dns.name.Name(labels[-child_labels:]).to_text().lower()
+        if child_zone in self.delegations:
+            return child_zone
+        return None
+
+    def answer(self, ip, query):
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        qname = question.name
+
+        if ip == RESOLVER_IP:
+            response.flags |= dns.flags.RA
+            hostname = qname.to_text().lower()
+            if hostname not in self.a_records:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+            elif question.rdtype == dns.rdatatype.A:
+                response.answer.append(
+                    dns.rrset.from_text(hostname, TTL, 'IN', 'A', self.a_records[hostname]),
+                )
+            return response
+
+        zone = self._find_zone(ip, qname)
+        if zone is None:
+            response.set_rcode(dns.rcode.REFUSED)
+            return response
+
+        child_zone = self._find_child_zone(zone, qname)
+        if child_zone is None:
+            response.flags |= dns.flags.AA
+            if qname.to_text().lower() == zone and question.rdtype == dns.rdatatype.NS:
+                response.answer.append(self._get_ns_rrset(zone))
+            elif zone.count('.') < 2:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+            return response
+
+        response.authority.append(self._get_ns_rrset(child_zone))
+        child_zone_name = dns.name.from_text(child_zone)
+        for hostname, nameserver_ip in self.delegations[child_zone]:
+            if dns.name.from_text(hostname).is_subdomain(child_zone_name):
+                response.additional.append(
+                    dns.rrset.from_text(hostname, TTL, 'IN', 'A', nameserver_ip),
+                )
+        return response
+
+    def _get_ns_rrset(self, zone):
+        return dns.rrset.from_text_list(
+            zone,
+            TTL,
+            'IN',
+            'NS',
+            [hostname for hostname, _ in self.delegations[zone]],
+        )
+
+
+class _NameserverProtocol(asyncio.DatagramProtocol):
+    def __init__(self, ip, hierarchy, latency, loss, query_counter):
+        self.ip = ip
+        self.hierarchy = hierarchy
+        self.latency = latency
+        self.loss = loss
+        self.query_counter = query_counter
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.query_counter is not None:
+            with self.query_counter.get_lock():
+                self.query_counter.value += 1
+        if random.random() < self.loss:
+            return
+        try:
+            query = dns.message.from_wire(data)
+        except dns.exception.DNSException:
+            return
+        wire = self.hierarchy.answer(self.ip, query).to_wire()
+        if self.latency:
+            asyncio.get_running_loop().call_later(self.latency, self.transport.sendto, wire, addr)
+        else:
+            self.transport.sendto(wire, addr)
+
+
+async def serve(hierarchy, port, latency, loss, query_counter=None, ready=None):
+    """
+    :type query_counter: multiprocessing.Value
+    Incremented for every query received, if given
+
+    :type ready: multiprocessing.Event
+    Set once every address is listening, if given
+    """
+    loop = asyncio.get_running_loop()
+    for ip in [*hierarchy.zones_by_ip, RESOLVER_IP]:
+        await loop.create_datagram_endpoint(
+            lambda ip=ip: _NameserverProtocol(ip, hierarchy, latency, loss, query_counter),
+            local_addr=(ip, port),
+        )
+    if ready is not None:
+        ready.set()
+    await asyncio.Event().wait()
+
+
+def run(hierarchy_kwargs, port, latency, loss, query_counter=None, ready=None, seed=0):
+    """
+    Entry point for running the hierarchy in a multiprocessing.Process
+    """
+    random.seed(seed)
+    asyncio.run(
+        serve(Hierarchy(**hierarchy_kwargs), port, latency, loss, query_counter, ready),
+    )
+
+
+def add_hierarchy_args(parser):
+    parser.add_argument('--tlds', type=int, default=2)
+    parser.add_argument('--tld-nameservers', type=int, default=4)
+    parser.add_argument('--domains-per-tld', type=int, default=1000)
+    parser.add_argument('--providers', type=int, default=8)
+    parser.add_argument('--provider-nameservers', type=int, default=4)
+    parser.add_argument(
+        '--glueless-fraction',
+        type=float,
+        default=0.5,
+        help='Fraction of domains whose nameservers get no glue.',
+    )
+    parser.add_argument('--port', type=int, default=5300)
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.0,
+        help='Seconds to delay each answer by.',
+    )
+    parser.add_argument('--loss', type=float, default=0.0, help='Fraction of queries to drop.')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def get_hierarchy_kwargs(args):
+    return {
+        'tlds': args.tlds,
+        'tld_nameservers': args.tld_nameservers,
+        'domains_per_tld': args.domains_per_tld,
+        'providers': args.providers,
+        'provider_nameservers': args.provider_nameservers,
+        'glueless_fraction': args.glueless_fraction,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a synthetic DNS hierarchy on loopback.')
+    add_hierarchy_args(parser)
+    args = parser.parse_args()
+    print(f'Serving on port {args.port}, resolver {RESOLVER_IP}')
+    run(get_hierarchy_kwargs(args), args.port, args.latency, args.loss, seed=args.seed)
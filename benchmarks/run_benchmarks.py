@@ -0,0 +1,306 @@
+"""
+Times TrustTrees against the synthetic DNS hierarchy in fake_dns.py,
+without touching the real internet.
+
+For each number of targets this reports how long, how many queries, and
+how much memory each of these took:
+
+    enumerate_nameservers    every target walked one after another
+    _draw_graph_from_cache   every walked target turned into a graph
+    main                     a whole `python -m trusttrees` run over the
+                             targets, with --no-graphing --jsonl
+
+Each size runs in a fresh process, so no caches carry over between sizes.
+Before timing anything, the run exits if walking a name under an
+already walked domain asks the TLD servers again, rather than reusing
+their referral from the delegation cache.
+Before the sizes, a `startup` row reports the quickest of STARTUP_RUNS
+fresh interpreters importing trusttrees.__main__, which every run and
+worker process pays before sending a query.
+
+    python benchmarks/run_benchmarks.py --sizes 10,100,1000 --latency 0.005
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_dns
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STARTUP_RUNS = 5
+
+
+def _configure_trusttrees(root_servers, port, max_queries_per_second):
+    from trusttrees import global_state
+
+    global_state.ROOT_SERVERS = tuple(
+        {'hostname': hostname, 'ip': ip}
+        for hostname, ip in root_servers
+    )
+    global_state.DNS_PORT = port
+    global_state.RESOLVERS = [fake_dns.RESOLVER_IP]
+    global_state.CHECK_DOMAIN_AVAILABILITY = False
+    global_state.MAX_QUERIES_PER_SECOND = max_queries_per_second
+    global_state.MAX_QUERIES_PER_SERVER_PER_SECOND = max_queries_per_second
+
+
+def _get_peak_rss_mb(rusage):
+    # ru_maxrss is in kilobytes on Linux
+    return rusage.ru_maxrss / 1024
+
+
+def _time_enumerate_and_draw(target_hostnames, root_servers, port, max_queries_per_second):
+    """
+    Runs in a fresh process
+
+    :returns: tuple (float, float, float)
+    Seconds spent walking, seconds spent drawing and peak RSS in MB
+    """
+    sys.path.insert(0, REPO_ROOT)
+    _configure_trusttrees(root_servers, port, max_queries_per_second)
+    from trusttrees.dns import enumerate_nameservers
+    from trusttrees.draw import _draw_graph_from_cache
+    from trusttrees.utils import clear_global_state, get_findings
+
+    walk_seconds = 0
+    draw_seconds = 0
+    for target_hostname in target_hostnames:
+        clear_global_state()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            enumerate_nameservers(target_hostname)
+            walk_seconds += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            _draw_graph_from_cache(target_hostname, get_findings())
+            draw_seconds += time.perf_counter() - start_time
+
+    return (
+        walk_seconds,
+        draw_seconds,
+        _get_peak_rss_mb(resource.getrusage(resource.RUSAGE_SELF)),
+    )
+
+
+def _count_uncached_tld_queries(target_hostname, root_servers, port, max_queries_per_second):
+    """
+    Runs in a fresh process. Walks `target_hostname`, then a name under it.
+
+    :returns: int
+    Queries the second walk sent to TLD servers, 0 if their referral was reused
+    """
+    sys.path.insert(0, REPO_ROOT)
+    _configure_trusttrees(root_servers, port, max_queries_per_second)
+    from trusttrees.dns import enumerate_nameservers
+    from trusttrees.utils import clear_global_state
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        enumerate_nameservers(target_hostname)
+    clear_global_state()
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        enumerate_nameservers('www.' + target_hostname)
+    return sum(
+        1
+        for line in output.getvalue().splitlines()
+        # TLD servers are on 127.2.0.0/16, see fake_dns.py
+        if line.startswith("[ STATUS ] Querying nameserver '127.2.")
+    )
+
+
+def _time_main(target_hostnames, root_servers, port, max_queries_per_second, workers):
+    """
+    :returns: tuple (float, float)
+    Seconds taken and peak RSS in MB
+    """
+    with tempfile.TemporaryDirectory() as run_dir:
+        targets_file = os.path.join(run_dir, 'targets.txt')
+        with open(targets_file, 'w') as f:
+            f.write('\n'.join(target_hostnames) + '\n')
+        resolvers_file = os.path.join(run_dir, 'resolvers.txt')
+        with open(resolvers_file, 'w') as f:
+            f.write(fake_dns.RESOLVER_IP + '\n')
+        root_servers_file = os.path.join(run_dir, 'root_servers.txt')
+        with open(root_servers_file, 'w') as f:
+            f.write(''.join(f'{hostname} {ip}\n' for hostname, ip in root_servers))
+
+        return _time_subprocess(
+            [
+                sys.executable, '-m', 'trusttrees',
+                '-l', targets_file,
+                '--resolvers', resolvers_file,
+                '--root-servers', root_servers_file,
+                '--dns-port', str(port),
+                '--max-qps', str(max_queries_per_second),
+                '--max-qps-per-server', str(max_queries_per_second),
+                '--workers', str(workers),
+                '--no-graphing',
+                '--jsonl', os.path.join(run_dir, 'results.jsonl'),
+            ],
+            cwd=run_dir,
+        )
+
+
+def _time_startup():
+    """
+    :returns: tuple (float, float)
+    Seconds taken and peak RSS in MB, of the quickest run
+    """
+    return min(
+        _time_subprocess([sys.executable, '-c', 'import trusttrees.__main__'])
+        for _ in range(STARTUP_RUNS)
+    )
+
+
+def _time_subprocess(args, cwd=None):
+    """
+    :returns: tuple (float, float)
+    Seconds taken and peak RSS in MB
+    """
+    start_time = time.perf_counter()
+    process = subprocess.Popen(
+        args,
+        cwd=cwd,
+        env=dict(os.environ, PYTHONPATH=REPO_ROOT),
+        stdout=subprocess.DEVNULL,
+    )
+    # Unlike Popen.wait(), this gives the resource usage of just this run
+    _, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start_time
+    process.returncode = os.WEXITSTATUS(status)
+    if process.returncode:
+        raise RuntimeError(f'{args[1:]} exited with {process.returncode}')
+
+    return (seconds, _get_peak_rss_mb(rusage))
+
+
+def _print_row(size, benchmark, seconds, queries, peak_rss_mb):
+    queries_per_second = f'{queries / seconds:.0f}' if queries and seconds else '-'
+    print(
+        f'{size:>8}  {benchmark:<24}  {seconds:>9.3f}  {queries if queries else "-":>8}'
+        f'  {queries_per_second:>11}  {peak_rss_mb:>13.1f}',
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        '--sizes',
+        default='10,100,1000',
+        help='Comma-separated numbers of targets to benchmark with.',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='--workers for the main benchmark.',
+    )
+    parser.add_argument(
+        '--max-qps',
+        type=float,
+        default=100000,
+        help='--max-qps and --max-qps-per-server, high to measure the engine, not the limiter.',
+    )
+    fake_dns.add_hierarchy_args(parser)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    hierarchy_kwargs = fake_dns.get_hierarchy_kwargs(args)
+    hierarchy_kwargs['domains_per_tld'] = max(
+        args.domains_per_tld,
+        -(-max(sizes) // args.tlds),
+    )
+    hierarchy = fake_dns.Hierarchy(**hierarchy_kwargs)
+    # Alternate between TLDs
+    domains = sorted(
+        hierarchy.get_domains(),
+        key=lambda domain: (int(domain.split('.')[0][1:]), domain),
+    )
+
+    query_counter = multiprocessing.Value('Q', 0)
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=fake_dns.run,
+        args=(
+            hierarchy_kwargs,
+            args.port,
+            args.latency,
+            args.loss,
+            query_counter,
+            ready,
+            args.seed,
+        ),
+        daemon=True,
+    )
+    server.start()
+    if not ready.wait(timeout=30):
+        sys.exit('The fake DNS hierarchy did not start, is the port free?')
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=multiprocessing.get_context('spawn'),
+    ) as executor:
+        uncached_tld_queries = executor.submit(
+            _count_uncached_tld_queries,
+            domains[0],
+            hierarchy.root_servers,
+            args.port,
+            args.max_qps,
+        ).result()
+    if uncached_tld_queries:
+        server.terminate()
+        sys.exit(
+            f'Walking www.{domains[0]} after {domains[0]} sent {uncached_tld_queries} '
+            'queries to TLD servers, their cached referral was not reused',
+        )
+
+    print(
+        f'{"targets":>8}  {"benchmark":<24}  {"seconds":>9}  {"queries":>8}'
+        f'  {"queries/sec":>11}  {"peak RSS (MB)":>13}',
+    )
+    seconds, peak_rss_mb = _time_startup()
+    _print_row('-', 'startup', seconds, 0, peak_rss_mb)
+    try:
+        for size in sizes:
+            target_hostnames = domains[:size]
+
+            queries_before = query_counter.value
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context('spawn'),
+            ) as executor:
+                walk_seconds, draw_seconds, peak_rss_mb = executor.submit(
+                    _time_enumerate_and_draw,
+                    target_hostnames,
+                    hierarchy.root_servers,
+                    args.port,
+                    args.max_qps,
+                ).result()
+            queries = query_counter.value - queries_before
+            _print_row(size, 'enumerate_nameservers', walk_seconds, queries, peak_rss_mb)
+            _print_row(size, '_draw_graph_from_cache', draw_seconds, 0, peak_rss_mb)
+
+            queries_before = query_counter.value
+            seconds, peak_rss_mb = _time_main(
+                target_hostnames,
+                hierarchy.root_servers,
+                args.port,
+                args.max_qps,
+                args.workers,
+            )
+            queries = query_counter.value - queries_before
+            _print_row(size, 'main', seconds, queries, peak_rss_mb)
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
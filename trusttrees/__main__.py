@@ -1,28 +1,120 @@
 import sys
+from collections import deque
 
-from .dns import enumerate_nameservers
+from . import global_state
+from .constants import MAX_TARGETS_AWAITING_FINDINGS
 from .draw import generate_graph
+from .incremental import update_fingerprint
+from .server import serve
+from .targets import (
+    TargetCheckpoint,
+    normalize_target_hostname,
+    read_target_hostnames,
+)
 from .usage import parse_args
 from .utils import (
-    clear_global_state,
     create_output_dir,
+    get_findings,
     print_logo,
     set_global_state_with_args,
+    start_base_domain_checks,
+    write_results_record,
+)
+from .workers import (
+    PENDING_TARGETS_PER_WORKER,
+    create_render_pool,
+    scan_targets,
+    wait_for_renders,
 )
 
 
+def _report_targets_awaiting_findings(
+    awaiting_findings,
+    max_awaiting,
+    export_formats,
+    args,
+    render_pool,
+    pending_renders,
+    results_file,
+    checkpoint,
+):
+    """
+    Writes results and graphs targets in the order they were scanned,
+    once their base domain checks are done or more than `max_awaiting`
+    targets are waiting.
+
+    :type awaiting_findings: deque of tuples
+    (target hostname, global_state.ScanState, start_base_domain_checks() result,
+    update_fingerprint() result or None)
+
+    :type results_file: file object or None
+    Given with --jsonl
+
+    :type checkpoint: TargetCheckpoint or None
+    Given with --checkpoint, targets are marked done once reported
+
+    :returns: set of concurrent.futures.Future
+    The renders still pending
+    """
+    while awaiting_findings and (
+        len(awaiting_findings) > max_awaiting
+        or
+        all(
+            is_available.done()
+            for _, _, is_available in awaiting_findings[0][2]
+        )
+    ):
+        target_hostname, scan_state, base_domain_checks, changes = awaiting_findings.popleft()
+        global_state.set_scan_state(scan_state)
+        findings = get_findings(base_domain_checks)
+        if results_file:
+            write_results_record(results_file, target_hostname, findings, changes)
+        render = None
+        if not args.no_graphing:
+            render = generate_graph(
+                target_hostname,
+                export_formats,
+                args.only_draw_problematic,
+                args.open,
+                args.upload_args,
+                render_pool,
+                findings,
+            )
+        if checkpoint:
+            checkpoint.mark_done(target_hostname)
+        if render:
+            pending_renders.add(render)
+            pending_renders = wait_for_renders(
+                pending_renders,
+                max_pending=args.render_workers * PENDING_TARGETS_PER_WORKER,
+            )
+    return pending_renders
+
+
 def main(command_line_args=sys.argv[1:]):
     args = parse_args(command_line_args)
 
     print_logo()
-    create_output_dir()
     set_global_state_with_args(args)
+    if args.serve_address:
+        # Threads rather than processes, so every job shares the caches
+        serve(args.serve_address, args.workers)
+        return 0
+    create_output_dir()
+
+    checkpoint = None
+    if args.checkpoint:
+        checkpoint = TargetCheckpoint(args.checkpoint, args.resume)
 
+    # Targets are read as they are needed, so huge lists are never all in memory
+    targets_file = None
     if args.target_hostname:
-        target_hostnames = [args.target_hostname]
+        target_hostnames = [normalize_target_hostname(args.target_hostname)]
+    elif args.target_hostnames_list == '-':
+        target_hostnames = read_target_hostnames(sys.stdin, checkpoint)
     else:
-        with open(args.target_hostnames_list) as targets:
-            target_hostnames = targets.read().splitlines()
+        targets_file = open(args.target_hostnames_list)
+        target_hostnames = read_target_hostnames(targets_file, checkpoint)
 
     export_formats = [
         extension.strip()
@@ -30,18 +122,79 @@ def main(command_line_args=sys.argv[1:]):
         args.export_formats.split(',')
     ]
 
-    for target_hostname in target_hostnames:
-        clear_global_state()
-        enumerate_nameservers(target_hostname)
-        if args.no_graphing:
-            continue
-        generate_graph(
-            target_hostname,
+    render_pool = create_render_pool(args)
+    pending_renders = set()
+    # Domain checks finish in the background while later targets are scanned
+    awaiting_findings = deque()
+    results_file = None
+    if args.jsonl:
+        # Keep the results of the targets a resumed run skips
+        results_file = open(args.jsonl, 'a' if args.resume else 'w')
+    try:
+        for target_hostname, scan_state in scan_targets(target_hostnames, args):
+            changes = None
+            if global_state.FINGERPRINT_STORE:
+                if scan_state is None:
+                    print(
+                        f'[ STATUS ] {target_hostname} is unchanged since its last scan, skipping!',
+                    )
+                    changes = []
+                else:
+                    global_state.set_scan_state(scan_state)
+                    changes = update_fingerprint(target_hostname)
+                    if not changes:
+                        print(f'[ STATUS ] {target_hostname} has no delegation changes, skipping!')
+                    for change in changes:
+                        print(
+                            f"[ CHANGE ] {target_hostname}: {change['ns_hostname']} for "
+                            f"{change['zone']} was {change['before']}, is now {change['after']}",
+                        )
+            if (
+                changes == []
+                or
+                (
+                    args.no_graphing
+                    and
+                    not results_file
+                )
+            ):
+                if checkpoint:
+                    checkpoint.mark_done(target_hostname)
+                continue
+            global_state.set_scan_state(scan_state)
+            awaiting_findings.append(
+                (target_hostname, scan_state, start_base_domain_checks(), changes),
+            )
+            pending_renders = _report_targets_awaiting_findings(
+                awaiting_findings,
+                MAX_TARGETS_AWAITING_FINDINGS,
+                export_formats,
+                args,
+                render_pool,
+                pending_renders,
+                results_file,
+                checkpoint,
+            )
+        pending_renders = _report_targets_awaiting_findings(
+            awaiting_findings,
+            0,
             export_formats,
-            args.only_draw_problematic,
-            args.open,
-            args.upload_args,
+            args,
+            render_pool,
+            pending_renders,
+            results_file,
+            checkpoint,
         )
+        wait_for_renders(pending_renders, max_pending=0)
+    finally:
+        if render_pool:
+            render_pool.shutdown()
+        if results_file:
+            results_file.close()
+        if checkpoint:
+            checkpoint.close()
+        if targets_file:
+            targets_file.close()
 
     return 0
 
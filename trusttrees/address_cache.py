@@ -0,0 +1,70 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class AddressCache:
+    """
+    Resolver lookups of nameserver hostnames which came without glue,
+    shared by every target scanned on one event loop.
+
+    Targets hosted by the same provider tend to share nameservers, and so
+    the same lookups. Concurrent lookups of a hostname share one query,
+    and found addresses are kept until their TTL runs out. Failed lookups
+    are not kept, so they are tried again for the next target.
+
+    Must only be used from the event loop it was created in.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        # Hostname to (expiry time, asyncio.Task of (addresses, TTL));
+        # the expiry time is None while the lookup is in-flight
+        self._lookups = OrderedDict()
+
+    def _lookup_done(self, hostname, task):
+        if self._lookups.get(hostname, (None, None))[1] is not task:
+            # Evicted, or replaced since
+            return
+        if (
+            not task.cancelled()
+            and
+            task.exception() is None
+            and
+            task.result()[0]
+        ):
+            _, ttl = task.result()
+            self._lookups[hostname] = (time.monotonic() + ttl, task)
+        else:
+            del self._lookups[hostname]
+
+    async def get_addresses(self, hostname, lookup):
+        """
+        :type lookup: function
+        Called with no arguments when there is no usable lookup of
+        `hostname`, returns a coroutine of tuple (tuple of strings, int),
+        the addresses and their TTL
+
+        :returns: tuple of strings
+        e.g.
+            ("1.2.3.4", "2001:db8::1") or ()
+        """
+        if hostname in self._lookups:
+            expires_at, task = self._lookups[hostname]
+            if (
+                expires_at is None
+                or
+                expires_at > time.monotonic()
+            ):
+                self._lookups.move_to_end(hostname)
+                addresses, _ = await asyncio.shield(task)
+                return addresses
+
+        task = asyncio.ensure_future(lookup())
+        self._lookups[hostname] = (None, task)
+        task.add_done_callback(lambda task: self._lookup_done(hostname, task))
+        while len(self._lookups) > self.max_entries:
+            self._lookups.popitem(last=False)
+
+        addresses, _ = await asyncio.shield(task)
+        return addresses
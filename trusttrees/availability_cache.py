@@ -0,0 +1,35 @@
+from .sqlite_cache import SQLiteCache
+
+
+class AvailabilityCache(SQLiteCache):
+    """
+    An on-disk store of registar availability results, so hosting-provider
+    base domains such as "awsdns-01.com" are not paid for again every run.
+
+    Keys are domains without a trailing '.', e.g.
+        "awsdns-01.com"
+
+    Registered domains rarely become available, so are kept for
+    `registered_ttl`. Available domains may be registered by anyone at
+    any time, so are only kept for `available_ttl`.
+    """
+
+    FILENAME = 'availability_cache.sqlite3'
+
+    def __init__(self, cache_dir, max_entries, registered_ttl, available_ttl):
+        super().__init__(cache_dir, max_entries)
+        self.registered_ttl = registered_ttl
+        self.available_ttl = available_ttl
+
+    def get(self, input_domain):
+        """
+        :returns: bool or None
+        """
+        return self.get_value(input_domain)
+
+    def set(self, input_domain, domain_available):
+        self.set_value(
+            input_domain,
+            domain_available,
+            self.available_ttl if domain_available else self.registered_ttl,
+        )
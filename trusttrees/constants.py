@@ -4,10 +4,67 @@ RED = '#ff0000'
 ORANGE = '#ff7700'
 YELLOW = '#fff200'
 
+DNS_PORT = 53
+MAX_IDLE_TCP_CONNECTIONS_PER_SERVER = 2
 DNS_WATCH_RESOLVER = '84.200.69.80'
-IPV6_ENABLED = False
 MAX_RECURSION_DEPTH = 4
 
+DEFAULT_MAX_IN_FLIGHT_QUERIES = 64
+# In seconds
+DEFAULT_QUERY_TIMEOUT = 5.0
+DEFAULT_QUERY_ATTEMPTS = 3
+
+# In seconds, see rtt_estimator.py
+INITIAL_QUERY_TIMEOUT = 1.0
+MIN_QUERY_TIMEOUT = 0.2
+
+# See resolver_pool.py
+RESOLVER_EJECTION_FAILURES = 3
+# In seconds
+RESOLVER_EJECTION_TIME = 30
+INITIAL_RESOLVER_HEDGE_DELAY = 0.5
+MIN_RESOLVER_HEDGE_DELAY = 0.05
+MAX_RESOLVERS_PER_LOOKUP = 3
+
+# Shared evenly between --workers, see rate_limiter.py
+DEFAULT_MAX_QUERIES_PER_SECOND = 500
+DEFAULT_MAX_QUERIES_PER_SERVER_PER_SECOND = 20
+MIN_QUERIES_PER_SERVER_PER_SECOND = 1
+# In seconds
+RATE_LIMIT_DECREASE_INTERVAL = 1
+
+DELEGATION_CACHE_MAX_ENTRIES = 100000
+# Hostnames, IPs and flags shared between results, see records.py
+SYMBOL_TABLE_MAX_ENTRIES = 1000000
+ADDRESS_CACHE_MAX_ENTRIES = 100000
+# Nameserver hostname to base domain, see public_suffix.py
+BASE_DOMAIN_CACHE_MAX_ENTRIES = 100000
+
+MAX_CONCURRENT_REGISTAR_CHECKS = 8
+# In seconds, for domains a registar reports as 'pending'
+REGISTAR_PENDING_DEADLINE = 10
+REGISTAR_PENDING_INITIAL_BACKOFF = 0.5
+REGISTAR_PENDING_MAX_BACKOFF = 4
+
+# In seconds, registered domains are re-checked much less often
+AVAILABILITY_CACHE_REGISTERED_TTL = 7 * 24 * 60 * 60
+AVAILABILITY_CACHE_AVAILABLE_TTL = 60 * 60
+AVAILABILITY_CACHE_MAX_ENTRIES = 100000
+
+# Changes to the --checkpoint file between commits
+CHECKPOINT_COMMIT_INTERVAL = 1000
+
+# Scanned targets held in memory while their domain checks finish
+MAX_TARGETS_AWAITING_FINDINGS = 64
+
+# See server.py, finished jobs are forgotten oldest first
+SERVE_MAX_FINISHED_JOBS = 10000
+SERVE_MAX_REQUEST_BYTES = 1024 * 1024
+
+DEFAULT_QUERY_CACHE_MAX_ENTRIES = 1000000
+# In seconds, for NXDOMAIN and empty responses which have no TTL of their own
+QUERY_CACHE_NEGATIVE_TTL = 900
+
 ROOT_SERVERS = (
     {
         'ip': '198.41.0.4',
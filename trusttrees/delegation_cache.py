@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+
+import dns.message
+import dns.name
+
+
+class DelegationCache:
+    """
+    Referrals seen while walking targets, kept across targets in a run.
+
+    A referral is a non-authoritative NS response that delegates to a
+    zone cut (e.g. "com." from a root server, or "foo.com." from a gTLD
+    server). The same nameserver would return the same referral for any
+    name under that cut, so later targets can reuse it until its TTL runs out.
+
+    Key format is the following:
+
+    KEY = (NS_TARGET_IP, ZONE_CUT)
+
+    e.g.
+        ("192.5.6.30", "foo.com.")
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # Values are (expiry time, response wire-format)
+        self._referrals = OrderedDict()
+
+    def get_referral(self, nameserver_ip, hostname):
+        """
+        Looks for the deepest cached zone cut above `hostname`
+        which the nameserver has referred us to.
+
+        :returns: dns.message.Message or None
+        """
+        now = time.monotonic()
+        zone_cut = dns.name.from_text(hostname)
+        with self._lock:
+            while zone_cut != dns.name.root:
+                key = (nameserver_ip, zone_cut.to_text().lower())
+                if key in self._referrals:
+                    expiry, wire = self._referrals[key]
+                    if expiry > now:
+                        self._referrals.move_to_end(key)
+                        return dns.message.from_wire(wire)
+                    del self._referrals[key]
+                zone_cut = zone_cut.parent()
+        return None
+
+    def add_referral(self, nameserver_zone, ns_result, ns_response):
+        """
+        Caches `ns_response` if it is a referral further down from `nameserver_zone`,
+        the zone the nameserver was delegated for. This keeps upward or lame referrals
+        from being replayed for names the nameserver is actually authoritative for.
+
+        :type nameserver_zone: string
+        e.g.
+            "com."
+
+        :type ns_result: NSResult
+        As returned by _ns_query() in dns.py
+        """
+        if (
+            not ns_result.success
+            or
+            ns_result.rcode != 0
+            or
+            'AA' in ns_result.flags
+            or
+            ns_result.answer_ns
+            or
+            not ns_result.authority_ns
+        ):
+            return
+
+        zone_cuts = {ns_record.hostname for ns_record in ns_result.authority_ns}
+        if len(zone_cuts) != 1:
+            return
+        (zone_cut,) = zone_cuts
+        zone_cut_name = dns.name.from_text(zone_cut)
+        if (
+            zone_cut_name == dns.name.from_text(nameserver_zone)
+            or
+            not zone_cut_name.is_subdomain(dns.name.from_text(nameserver_zone))
+            or
+            not dns.name.from_text(ns_result.hostname).is_subdomain(zone_cut_name)
+        ):
+            return
+
+        ttl = min(
+            ns_record.ttl
+            for ns_record in ns_result.authority_ns + ns_result.additional_ns
+        )
+        key = (ns_result.nameserver_ip, zone_cut)
+        with self._lock:
+            self._referrals[key] = (time.monotonic() + ttl, ns_response.to_wire())
+            self._referrals.move_to_end(key)
+            while len(self._referrals) > self.max_entries:
+                self._referrals.popitem(last=False)
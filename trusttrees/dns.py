@@ -1,24 +1,60 @@
+import asyncio
+import functools
 import secrets
+import threading
+import time
+import weakref
 
+import dns.exception
 import dns.flags
+import dns.message
 import dns.rcode
 import dns.rdatatype
 import dns.resolver
 
 from . import global_state
+from .address_cache import AddressCache
 from .constants import (
-    IPV6_ENABLED,
+    ADDRESS_CACHE_MAX_ENTRIES,
     MAX_RECURSION_DEPTH,
-    ROOT_SERVERS,
+    MAX_RESOLVERS_PER_LOOKUP,
 )
+from .rate_limiter import RateLimiter
+from .records import (
+    NSRecord,
+    NSResult,
+    intern_symbol,
+)
+from .resolver_pool import ResolverPool
+from .rtt_estimator import RTTEstimator
+from .transport import DNSTransport
 from .utils import is_authoritative
 
 
+# Event loop to DNSTransport, see _get_transport()
+_transports = weakref.WeakKeyDictionary()
+# Event loop to RateLimiter, see _get_rate_limiter()
+_rate_limiters = weakref.WeakKeyDictionary()
+# Event loop to RTTEstimator, see _get_rtt_estimator()
+_rtt_estimators = weakref.WeakKeyDictionary()
+# Event loop to AddressCache, see _get_address_cache()
+_address_caches = weakref.WeakKeyDictionary()
+# Event loop to ResolverPool, see _get_resolver_pool()
+_resolver_pools = weakref.WeakKeyDictionary()
+_thread_local = threading.local()
+
+
 def _get_random_root_ns_set():
-    return secrets.choice(ROOT_SERVERS)
+    return secrets.choice(global_state.ROOT_SERVERS)
 
 
-def _wrap_ns_query(hostname, nameserver_ip, nameserver_hostname):
+async def _wrap_ns_query(
+    hostname,
+    nameserver_ip,
+    nameserver_hostname,
+    query_slots,
+    nameserver_zone=None,
+):
     """
     This writes to global_state.MASTER_DNS_CACHE, which is
     later read from in _draw_graph_from_cache() of draw.py
@@ -31,85 +67,395 @@ def _wrap_ns_query(hostname, nameserver_ip, nameserver_hostname):
     if cache_key in global_state.MASTER_DNS_CACHE:
         return global_state.MASTER_DNS_CACHE[cache_key]
 
-    global_state.MASTER_DNS_CACHE[cache_key] = _ns_query(
+    # Then check if a previous run saved it to disk
+    if global_state.QUERY_CACHE:
+        ns_result = global_state.QUERY_CACHE.get(cache_key)
+        if ns_result is not None:
+            print(f"[ STATUS ] Using saved result for '{cache_key}'")
+            _replay_ns_result(ns_result)
+            global_state.MASTER_DNS_CACHE[cache_key] = ns_result
+            return ns_result
+
+    global_state.MASTER_DNS_CACHE[cache_key] = await _ns_query(
         hostname,
         nameserver_ip,
         nameserver_hostname,
+        query_slots,
+        nameserver_zone,
     )
+    if global_state.QUERY_CACHE:
+        global_state.QUERY_CACHE.set(cache_key, global_state.MASTER_DNS_CACHE[cache_key])
     return global_state.MASTER_DNS_CACHE[cache_key]
 
 
-def _dns_query(target_hostname, query_type, target_nameserver):
-    res = dns.resolver.Resolver(configure=False)
-    res.nameservers = [target_nameserver]
-    result = res.query(
-        qname=target_hostname,
-        rdtype=query_type,
-        raise_on_no_answer=False,
-    )
-    return result
+def _replay_ns_result(ns_result):
+    """
+    Makes the same writes to
+        global_state.AUTHORITATIVE_NS_LIST,
+        global_state.NS_IP_MAP
+        and global_state.QUERY_ERROR_LIST
+    that _ns_query() made when it originally returned `ns_result`
+    """
+    if not ns_result.success:
+        global_state.QUERY_ERROR_LIST.append(
+            {
+                'hostname': ns_result.hostname,
+                'error': ns_result.rcode_string,
+                'ns_hostname': ns_result.nameserver_hostname,
+            },
+        )
+        return
 
+    for ns_record in ns_result.additional_ns:
+        global_state.NS_IP_MAP[ns_record.ns_hostname] = _get_usable_ips(
+            global_state.NS_IP_MAP[ns_record.ns_hostname] + ns_record.ns_ips,
+        )
+    for ns_record in ns_result.authority_ns + ns_result.answer_ns:
+        if not global_state.NS_IP_MAP[ns_record.ns_hostname]:
+            global_state.NS_IP_MAP[ns_record.ns_hostname] = ns_record.ns_ips
+
+    if is_authoritative(ns_result.flags):
+        for ns_records in ns_result.get_sections():
+            for ns_record in ns_records:
+                if ns_record.ns_hostname not in global_state.AUTHORITATIVE_NS_LIST:
+                    global_state.AUTHORITATIVE_NS_LIST.append(ns_record.ns_hostname)
 
-def _try_to_get_first_ip_for_hostname(hostname):
+
+def _get_transport():
     """
-    :returns: string
-    e.g.
-        "1.2.3.4" or ""
+    :returns: DNSTransport
+    The one shared by every query made from the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _transports:
+        _transports[loop] = DNSTransport(port=global_state.DNS_PORT)
+    return _transports[loop]
+
+
+def _get_rate_limiter():
     """
+    :returns: RateLimiter
+    The one shared by every query made from the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _rate_limiters:
+        _rate_limiters[loop] = RateLimiter(
+            max_queries_per_second=global_state.MAX_QUERIES_PER_SECOND,
+            max_queries_per_server_per_second=global_state.MAX_QUERIES_PER_SERVER_PER_SECOND,
+            resolvers=global_state.RESOLVERS,
+        )
+    return _rate_limiters[loop]
+
+
+def _get_rtt_estimator():
+    """
+    :returns: RTTEstimator
+    The one shared by every query made from the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _rtt_estimators:
+        _rtt_estimators[loop] = RTTEstimator(
+            max_timeout=global_state.QUERY_TIMEOUT,
+            max_attempts=global_state.QUERY_ATTEMPTS,
+        )
+    return _rtt_estimators[loop]
+
+
+def _get_address_cache():
+    """
+    :returns: AddressCache
+    The one shared by every query made from the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _address_caches:
+        _address_caches[loop] = AddressCache(max_entries=ADDRESS_CACHE_MAX_ENTRIES)
+    return _address_caches[loop]
+
+
+def _get_resolver_pool():
+    """
+    :returns: ResolverPool
+    The one shared by every query made from the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _resolver_pools:
+        _resolver_pools[loop] = ResolverPool(global_state.RESOLVERS)
+    return _resolver_pools[loop]
+
+
+def _get_event_loop():
+    """
+    Each thread runs every target it scans on the same event loop,
+    so its DNSTransport sockets are reused between targets
+
+    :returns: asyncio.AbstractEventLoop
+    """
+    if not hasattr(_thread_local, 'event_loop'):
+        _thread_local.event_loop = asyncio.new_event_loop()
+    return _thread_local.event_loop
+
+
+async def _dns_query(target_hostname, query_type, target_nameserver, query_slots):
+    """
+    Sends a single query to a single nameserver, once the rate limiter
+    allows it. Unanswered queries are sent again, up to
+    global_state.QUERY_ATTEMPTS times in total, waiting longer each time,
+    see rtt_estimator.py
+
+    Raises the same exceptions dns.resolver.Resolver.query() would
+    when given one nameserver, so callers can treat the two alike.
+
+    :type query_slots: asyncio.Semaphore
+    Bounds the number of queries in-flight at once
+
+    :returns: dns.message.Message
+    """
+    query = dns.message.make_query(target_hostname, query_type)
+    rate_limiter = _get_rate_limiter()
+    rtt_estimator = _get_rtt_estimator()
+    for attempt in range(rtt_estimator.get_attempts(target_nameserver)):
+        await rate_limiter.wait(target_nameserver)
+        async with query_slots:
+            start_time = time.monotonic()
+            try:
+                # The ID is kept, so a late answer to an earlier attempt still counts
+                response = await _get_transport().query(
+                    query,
+                    target_nameserver,
+                    timeout=rtt_estimator.get_timeout(target_nameserver, attempt),
+                )
+            except dns.exception.Timeout:
+                rate_limiter.record_timeout(target_nameserver)
+                continue
+            except OSError:
+                raise dns.resolver.Timeout()
+            except (dns.exception.DNSException, EOFError):
+                # Malformed or mismatched response
+                raise dns.resolver.NoNameservers()
+        rate_limiter.record_answer(target_nameserver)
+        rtt_estimator.record_answer(
+            target_nameserver,
+            rtt=time.monotonic() - start_time if attempt == 0 else None,
+        )
+        break
+    else:
+        rtt_estimator.record_no_answer(target_nameserver)
+        raise dns.resolver.Timeout()
+
+    rcode = response.rcode()
+    if rcode == dns.rcode.NXDOMAIN:
+        raise dns.resolver.NXDOMAIN()
+    if rcode == dns.rcode.YXDOMAIN:
+        raise dns.resolver.YXDOMAIN()
+    if rcode != dns.rcode.NOERROR:
+        raise dns.resolver.NoNameservers()
+    return response
+
+
+async def _ask_resolver(hostname, query_type, resolver, query_slots):
+    """
+    _dns_query() which records how `resolver` did in the running event
+    loop's ResolverPool
+
+    :returns: dns.message.Message
+    """
+    resolver_pool = _get_resolver_pool()
+    start_time = time.monotonic()
     try:
-        answer = _dns_query(
+        response = await _dns_query(
             hostname,
-            query_type='A',
-            target_nameserver=secrets.choice(global_state.RESOLVERS),
+            query_type=query_type,
+            target_nameserver=resolver,
+            query_slots=query_slots,
         )
-        if answer.rrset:
-            return str(answer.rrset[0])
     except (
         dns.resolver.NoNameservers,
-        dns.resolver.NXDOMAIN,
         dns.resolver.Timeout,
+    ):
+        resolver_pool.record_failure(resolver)
+        raise
+    except (
+        dns.resolver.NXDOMAIN,
         dns.resolver.YXDOMAIN,
     ):
-        pass
-    return ''
+        resolver_pool.record_answer(resolver, time.monotonic() - start_time)
+        raise
+    resolver_pool.record_answer(resolver, time.monotonic() - start_time)
+    return response
 
 
-def _ns_query(hostname, nameserver_ip, nameserver_hostname):
+async def _resolver_query(hostname, query_type, query_slots):
     """
-    Performs the NS query.
+    Asks a resolver chosen by the running event loop's ResolverPool.
+    If it has not answered within its hedge delay, or every resolver asked
+    so far failed, another resolver is asked too, up to
+    MAX_RESOLVERS_PER_LOOKUP of them. Whichever answers first is used.
 
-    Writes to
-        global_state.AUTHORITATIVE_NS_LIST,
-        global_state.NS_IP_MAP
-        and global_state.QUERY_ERROR_LIST
-    which is later read from in _get_graph_data_for_ns_result() in draw.py
+    Raises the same exceptions as _dns_query()
 
-    :returns: dictionary
+    :returns: dns.message.Message
+    """
+    resolver_pool = _get_resolver_pool()
+    asked_resolvers = []
+    pending = set()
+
+    def ask_another_resolver():
+        resolver = resolver_pool.choose(exclude=asked_resolvers)
+        if resolver is not None:
+            asked_resolvers.append(resolver)
+            pending.add(
+                asyncio.ensure_future(
+                    _ask_resolver(hostname, query_type, resolver, query_slots),
+                ),
+            )
+
+    ask_another_resolver()
+    try:
+        while pending:
+            can_ask_another = len(asked_resolvers) < MAX_RESOLVERS_PER_LOOKUP
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=(
+                    resolver_pool.get_hedge_delay(asked_resolvers[-1])
+                    if can_ask_another
+                    else None
+                ),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                if not isinstance(
+                    task.exception(),
+                    (dns.resolver.NoNameservers, dns.resolver.Timeout),
+                ):
+                    # An answer, even if it is NXDOMAIN
+                    return task.result()
+                last_failed_task = task
+
+            if (
+                can_ask_another
+                and
+                (not done or not pending)
+            ):
+                ask_another_resolver()
+        return last_failed_task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _get_usable_ips(ips):
+    """
+    :type ips: iterable of strings
+
+    :returns: tuple of strings
+    `ips` without duplicates, or IPv6 addresses unless global_state.IPV6_ENABLED
+    """
+    return tuple(
+        dict.fromkeys(
+            intern_symbol(ip)
+            for ip in ips
+            if (
+                global_state.IPV6_ENABLED
+                or
+                ':' not in ip
+            )
+        ),
+    )
+
+
+async def _try_to_get_ips_for_hostname(hostname, query_slots):
+    """
+    Looks up A records, and AAAA records if global_state.IPV6_ENABLED
+
+    :returns: tuple (tuple of strings, int)
+    The addresses and their lowest TTL
     e.g.
-         {
-             'nameserver_ip': '1.2.3.4',
-             'rcode_string': 'NOERROR',
-             'flags': [
-                 'QR',
-                 'RD'
-             ],
-             'authority_ns': [
-                 {
-                     'ns_ip': '5.6.7.8',
-                     'hostname': 'foo.',
-                     'ns_hostname': 'demand.alpha.aridns.net.au.',
-                     'ttl': 172800
-                 },
-                 ...
-            ],
-            'additional_ns': [],
-            'answer_ns': [],
-            'hostname': 'bar.foo.',
-            'rcode': 0,
-            'success': True,
-            'nameserver_hostname': 'g.root-servers.net.'
-        }
+        (("1.2.3.4", "2001:db8::1"), 3600) or ((), 0)
+    """
+    query_types = ['A']
+    if global_state.IPV6_ENABLED:
+        query_types.append('AAAA')
+
+    ips = []
+    ttls = []
+    for query_type, response in zip(
+        query_types,
+        await asyncio.gather(
+            *(
+                _resolver_query(hostname, query_type, query_slots)
+                for query_type in query_types
+            ),
+            return_exceptions=True,
+        ),
+    ):
+        if isinstance(response, BaseException):
+            if not isinstance(
+                response,
+                (
+                    dns.resolver.NoNameservers,
+                    dns.resolver.NXDOMAIN,
+                    dns.resolver.Timeout,
+                    dns.resolver.YXDOMAIN,
+                ),
+            ):
+                raise response
+            continue
+        for rrset in response.answer:
+            if rrset.rdtype == dns.rdatatype.from_text(query_type):
+                ips.extend(str(rrset_value).lower() for rrset_value in rrset.items)
+                ttls.append(int(rrset.ttl))
+
+    ips = _get_usable_ips(ips)
+    if not ips:
+        return ((), 0)
+    return (ips, min(ttls))
+
+
+async def _get_ips_for_hostnames(hostnames, query_slots):
     """
+    Looks up every hostname at once, sharing lookups through the
+    running event loop's AddressCache
+
+    :type hostnames: list of strings
+
+    :returns: dictionary
+    Of hostname to tuple of IPs, which may be empty
+    """
+    address_cache = _get_address_cache()
+    ips = await asyncio.gather(
+        *(
+            address_cache.get_addresses(
+                hostname,
+                functools.partial(
+                    _try_to_get_ips_for_hostname,
+                    hostname,
+                    query_slots=query_slots,
+                ),
+            )
+            for hostname in hostnames
+        )
+    )
+    return dict(zip(hostnames, ips))
+
+
+async def _get_ns_response(hostname, nameserver_ip, nameserver_hostname, query_slots):
+    """
+    Replays a cached referral from global_state.DELEGATION_CACHE if there is one,
+    otherwise sends the NS query.
+
+    :returns: dns.message.Message
+    """
+    ns_response = global_state.DELEGATION_CACHE.get_referral(nameserver_ip, hostname)
+    if ns_response is not None:
+        print(
+            "[ STATUS ] Using cached referral from nameserver '{}/{}' for NS of '{}'".format(
+                nameserver_ip,
+                nameserver_hostname,
+                hostname,
+            ),
+        )
+        return ns_response
+
     print(
         "[ STATUS ] Querying nameserver '{}/{}' for NS of '{}'".format(
             nameserver_ip,
@@ -117,40 +463,64 @@ def _ns_query(hostname, nameserver_ip, nameserver_hostname):
             hostname,
         ),
     )
+    return await _dns_query(
+        hostname,
+        query_type='NS',
+        target_nameserver=nameserver_ip,
+        query_slots=query_slots,
+    )
+
+
+async def _ns_query(
+    hostname,
+    nameserver_ip,
+    nameserver_hostname,
+    query_slots,
+    nameserver_zone=None,
+):
+    """
+    Performs the NS query.
+
+    :type nameserver_zone: string
+    The zone we were delegated to this nameserver for, if known.
+    Referrals further down from it are saved to global_state.DELEGATION_CACHE
+
+    Writes to
+        global_state.AUTHORITATIVE_NS_LIST,
+        global_state.NS_IP_MAP
+        and global_state.QUERY_ERROR_LIST
+    which is later read from in _get_graph_data_for_ns_result() in draw.py
+
+    :returns: NSResult
+    See records.py
+    """
+    hostname = intern_symbol(hostname)
+    nameserver_hostname = intern_symbol(nameserver_hostname)
+    nameserver_ip = intern_symbol(nameserver_ip)
     dns_query_error = None
-    return_dict = {
-        'hostname': hostname,
-        'nameserver_hostname': nameserver_hostname,
-        'nameserver_ip': nameserver_ip,
-        'additional_ns': [],
-        'authority_ns': [],
-        'answer_ns': [],
-        'flags': [],
-        'success': False,
-    }
 
     try:
-        ns_result = _dns_query(
+        ns_response = await _get_ns_response(
             hostname,
-            query_type='NS',
-            target_nameserver=nameserver_ip,
+            nameserver_ip,
+            nameserver_hostname,
+            query_slots,
         )
     except dns.resolver.NoNameservers:
         # TODO: This fucking blows, figure out a way to do this without an exception
         dns_query_error = 'FATAL_ERROR'
-        return_dict['rcode'] = -1
+        rcode = -1
     except dns.resolver.NXDOMAIN:
         dns_query_error = 'NXDOMAIN'
-        return_dict['rcode'] = dns.rcode.NXDOMAIN
+        rcode = dns.rcode.NXDOMAIN
     except dns.resolver.Timeout:
         dns_query_error = 'TIMEOUT'
-        return_dict['rcode'] = -1
+        rcode = -1
     except dns.resolver.YXDOMAIN:
         dns_query_error = 'YXDOMAIN'
-        return_dict['rcode'] = dns.rcode.YXDOMAIN
+        rcode = dns.rcode.YXDOMAIN
 
     if dns_query_error:
-        return_dict['rcode_string'] = dns_query_error
         global_state.QUERY_ERROR_LIST.append(
             {
                 'hostname': hostname,
@@ -158,137 +528,349 @@ def _ns_query(hostname, nameserver_ip, nameserver_hostname):
                 'ns_hostname': nameserver_hostname,
             },
         )
-        return return_dict
-
-    # If we have made it this far, we can mark the response as successful
-    return_dict['success'] = True
+        return NSResult(
+            hostname=hostname,
+            nameserver_hostname=nameserver_hostname,
+            nameserver_ip=nameserver_ip,
+            rcode=rcode,
+            rcode_string=dns_query_error,
+        )
 
-    return_dict['flags'] = dns.flags.to_text(
-        ns_result.response.flags,
-    ).split(' ')
-    return_dict['rcode'] = ns_result.response.rcode()
-    return_dict['rcode_string'] = dns.rcode.to_text(return_dict['rcode'])
+    flags = tuple(
+        intern_symbol(flag)
+        for flag in dns.flags.to_text(ns_response.flags).split(' ')
+    )
+    rcode = ns_response.rcode()
 
     # ADDITIONAL section of NS answer
-    for rrset in ns_result.response.additional:
+    additional_ns = []
+    for rrset in ns_response.additional:
+        # Glue, IPv6 addresses are dropped by _get_usable_ips() unless --ipv6 is given
+        if rrset.rdtype not in (dns.rdatatype.A, dns.rdatatype.AAAA):
+            continue
+        ns_ips = _get_usable_ips(str(rrset_value).lower() for rrset_value in rrset.items)
+        if not ns_ips:
+            continue
+        ns_hostname = intern_symbol(str(rrset.name).lower())
+
+        # Store these glue records in our global_state.NS_IP_MAP for later
+        global_state.NS_IP_MAP[ns_hostname] = _get_usable_ips(
+            global_state.NS_IP_MAP[ns_hostname] + ns_ips,
+        )
+
+        additional_ns.append(
+            NSRecord(
+                ns_hostname=ns_hostname,
+                ns_ips=ns_ips,
+                ttl=int(rrset.ttl),
+            ),
+        )
+
+        # If this was an authoritative answer, we need to save that for graphing
+        if (
+            is_authoritative(flags)
+            and
+            ns_hostname not in global_state.AUTHORITATIVE_NS_LIST
+        ):
+            global_state.AUTHORITATIVE_NS_LIST.append(ns_hostname)
+
+    # Since NS results sometimes do not have a glue record, we have to retrieve it..
+    # All of them are sent to resolvers at once, rather than one at a time
+    glue_less_ns_hostnames = []
+    for rrset in ns_response.authority + ns_response.answer:
         if rrset.rdtype != dns.rdatatype.NS:
             continue
         for rrset_value in rrset.items:
+            ns_hostname = str(rrset_value).lower()
             if (
-                ':' in str(rrset_value)
-                and
-                not IPV6_ENABLED
-            ):
-                continue
-            ns_ip = str(rrset_value).lower()
-            ns_hostname = str(rrset.name).lower()
-
-            # Store this glue record in our global_state.NS_IP_MAP for later
-            global_state.NS_IP_MAP[ns_hostname] = ns_ip
-
-            return_dict['additional_ns'].append(
-                {
-                    'ns_ip': ns_ip,
-                    'ttl': int(rrset.ttl),
-                    'ns_hostname': ns_hostname,
-                },
-            )
-
-            # If this was an authoritative answer, we need to save that for graphing
-            if (
-                is_authoritative(return_dict['flags'])
+                not global_state.NS_IP_MAP.get(ns_hostname)
                 and
-                ns_hostname not in global_state.AUTHORITATIVE_NS_LIST
+                ns_hostname not in glue_less_ns_hostnames
             ):
-                global_state.AUTHORITATIVE_NS_LIST.append(ns_hostname)
+                glue_less_ns_hostnames.append(ns_hostname)
+    looked_up_ips = await _get_ips_for_hostnames(glue_less_ns_hostnames, query_slots)
 
-    for section_of_NS_answer, corresponding_key in (
+    authority_ns = []
+    answer_ns = []
+    for section_of_NS_answer, ns_records in (
         (
-            ns_result.response.authority,
-            'authority_ns',
+            ns_response.authority,
+            authority_ns,
         ),
         (
-            ns_result.response.answer,
-            'answer_ns',
+            ns_response.answer,
+            answer_ns,
         ),
     ):
         for rrset in section_of_NS_answer:
             if rrset.rdtype != dns.rdatatype.NS:
                 continue
+            rrset_hostname = intern_symbol(str(rrset.name).lower())
             for rrset_value in rrset.items:
-                ns_hostname = str(rrset_value).lower()
+                ns_hostname = intern_symbol(str(rrset_value).lower())
 
-                ns_dict = {
-                    'ns_hostname': ns_hostname,
-                    'ttl': int(rrset.ttl),
-                    'hostname': str(rrset.name).lower(),
-                }
-
-                # Since NS results sometimes do not have a glue record, we have to retrieve it..
                 # If ns_hostname is not in our DNS cache
                 if not global_state.NS_IP_MAP[ns_hostname]:
-                    # Send an A query to a resolver to get the IP
-                    global_state.NS_IP_MAP[ns_hostname] = _try_to_get_first_ip_for_hostname(
-                        ns_hostname,
-                    )
-
-                if global_state.NS_IP_MAP[ns_hostname]:
-                    ns_dict['ns_ip'] = global_state.NS_IP_MAP[ns_hostname]
-
-                return_dict[corresponding_key].append(ns_dict)
+                    global_state.NS_IP_MAP[ns_hostname] = looked_up_ips[ns_hostname]
+
+                ns_records.append(
+                    NSRecord(
+                        ns_hostname=ns_hostname,
+                        ns_ips=global_state.NS_IP_MAP[ns_hostname],
+                        ttl=int(rrset.ttl),
+                        hostname=rrset_hostname,
+                    ),
+                )
 
                 # If this was an authoritative answer, we need to save that for graphing
                 if (
-                    is_authoritative(return_dict['flags'])
+                    is_authoritative(flags)
                     and
                     ns_hostname not in global_state.AUTHORITATIVE_NS_LIST
                 ):
                     global_state.AUTHORITATIVE_NS_LIST.append(ns_hostname)
 
-    return return_dict
+    # If we have made it this far, we can mark the response as successful
+    ns_result = NSResult(
+        hostname=hostname,
+        nameserver_hostname=nameserver_hostname,
+        nameserver_ip=nameserver_ip,
+        rcode=rcode,
+        rcode_string=intern_symbol(dns.rcode.to_text(rcode)),
+        success=True,
+        flags=flags,
+        additional_ns=tuple(additional_ns),
+        authority_ns=tuple(authority_ns),
+        answer_ns=tuple(answer_ns),
+    )
+
+    if nameserver_zone:
+        global_state.DELEGATION_CACHE.add_referral(nameserver_zone, ns_result, ns_response)
 
+    return ns_result
 
-def _recursively_enumerate_nameservers(domain_name, previous_ns_result, depth=0):
+
+def _get_nameservers_to_query(ns_results):
     """
-    Take the previous NS result and do NS queries against all of the returned nameservers.
+    Collects every nameserver returned in a delegation level, in the order
+    the blocking walk used to visit them.
+
+    Every address of a nameserver is included, as each could be a
+    separate server, e.g. an IPv4 and an IPv6 anycast instance.
+
+    :returns: dictionary
+    Of (IP, hostname) to the zone the nameserver was delegated for, if known
+    e.g.
+        {("1.2.3.4", "ns1.foo.com."): "foo.com.", ...}
     """
-    for section_of_NS_answer in (
-        'additional_ns',
-        'answer_ns',
-        'authority_ns',
-    ):
-        for ns_rrset in previous_ns_result[section_of_NS_answer]:
-            if (
-                section_of_NS_answer != 'additional_ns'
-                and
-                'ns_ip' not in ns_rrset
-            ):
-                continue
-            ns_result = _wrap_ns_query(
+    nameservers = {}
+    for ns_result in ns_results:
+        for ns_records in (
+            ns_result.additional_ns,
+            ns_result.answer_ns,
+            ns_result.authority_ns,
+        ):
+            for ns_record in ns_records:
+                for ns_ip in ns_record.ns_ips:
+                    nameserver = (ns_ip, ns_record.ns_hostname)
+                    # Glue has no zone, so the zone from a later section is kept
+                    if nameservers.get(nameserver) is None:
+                        nameservers[nameserver] = ns_record.hostname
+    return nameservers
+
+
+def _alias_ns_result(ns_result, nameserver_hostname):
+    """
+    Copies the result of asking one nameserver hostname, for another hostname
+    with the same IP, so that hostname still gets its own edges when graphing.
+
+    Writes to global_state.QUERY_ERROR_LIST, as errors are graphed per hostname
+
+    :returns: NSResult
+    """
+    ns_result = ns_result.with_nameserver_hostname(intern_symbol(nameserver_hostname))
+    if not ns_result.success:
+        global_state.QUERY_ERROR_LIST.append(
+            {
+                'hostname': ns_result.hostname,
+                'error': ns_result.rcode_string,
+                'ns_hostname': ns_result.nameserver_hostname,
+            },
+        )
+    return ns_result
+
+
+async def _enumerate_nameservers(domain_name):
+    """
+    Walks the delegation chain one level at a time, querying every
+    nameserver of a level concurrently.
+
+    Each distinct nameserver IP is only asked once. Any other hostnames
+    which resolve to the same IP, e.g. anycast or shared hosting, get a
+    copy of that result from _alias_ns_result().
+
+    Each response is expanded once, at the shallowest depth it is seen,
+    so this finds the same nameservers as following every delegation
+    path depth-first up to MAX_RECURSION_DEPTH.
+    """
+    domain_name = domain_name.lower()
+    query_slots = asyncio.Semaphore(global_state.MAX_IN_FLIGHT_QUERIES)
+    # Nameserver IP to the task asking it about domain_name
+    questions = {}
+
+    async def ask(nameserver_ip, nameserver_hostname, nameserver_zone):
+        """
+        :returns: tuple (NSResult, bool)
+        The result, and whether it is the first for this nameserver IP
+        """
+        if nameserver_ip in questions:
+            ns_result = await questions[nameserver_ip]
+            cache_key = f'{domain_name}|ns|{nameserver_ip}|{nameserver_hostname}'
+            if cache_key not in global_state.MASTER_DNS_CACHE:
+                global_state.MASTER_DNS_CACHE[cache_key] = _alias_ns_result(
+                    ns_result,
+                    nameserver_hostname,
+                )
+            return (global_state.MASTER_DNS_CACHE[cache_key], False)
+
+        questions[nameserver_ip] = asyncio.ensure_future(
+            _wrap_ns_query(
                 hostname=domain_name,
-                nameserver_ip=ns_rrset['ns_ip'],
-                nameserver_hostname=ns_rrset['ns_hostname'],
-            )
-            if depth < MAX_RECURSION_DEPTH:
-                _recursively_enumerate_nameservers(
-                    domain_name,
-                    previous_ns_result=ns_result,
-                    depth=depth + 1,
+                nameserver_ip=nameserver_ip,
+                nameserver_hostname=nameserver_hostname,
+                query_slots=query_slots,
+                nameserver_zone=nameserver_zone,
+            ),
+        )
+        return (await questions[nameserver_ip], True)
+
+    # Get random root server and query it to bootstrap our walk of the chain
+    root_ns_set = _get_random_root_ns_set()
+    previous_ns_results = [
+        (await ask(root_ns_set['ip'], root_ns_set['hostname'], '.'))[0],
+    ]
+    asked_nameservers = {(root_ns_set['ip'], root_ns_set['hostname'])}
+
+    for _ in range(MAX_RECURSION_DEPTH + 1):
+        nameservers = [
+            (nameserver_ip, nameserver_hostname, nameserver_zone)
+            for (
+                (nameserver_ip, nameserver_hostname),
+                nameserver_zone,
+            ) in _get_nameservers_to_query(previous_ns_results).items()
+            if (nameserver_ip, nameserver_hostname) not in asked_nameservers
+        ]
+        if not nameservers:
+            break
+        asked_nameservers.update(
+            (nameserver_ip, nameserver_hostname)
+            for nameserver_ip, nameserver_hostname, _ in nameservers
+        )
+
+        # A copied result leads to the same nameservers as the one it
+        # was copied from, so only first results are expanded further
+        previous_ns_results = [
+            ns_result
+            for ns_result, is_first_for_ip in await asyncio.gather(
+                *(
+                    ask(nameserver_ip, nameserver_hostname, nameserver_zone)
+                    for nameserver_ip, nameserver_hostname, nameserver_zone in nameservers
                 )
+            )
+            if is_first_for_ip
+        ]
 
 
 def enumerate_nameservers(domain_name):
     if not domain_name.endswith('.'):
         domain_name += '.'
 
-    # Get random root server and query it to bootstrap our walk of the chain
-    root_ns_set = _get_random_root_ns_set()
-    tld_ns_result = _wrap_ns_query(
-        hostname=domain_name,
-        nameserver_ip=root_ns_set['ip'],
-        nameserver_hostname=root_ns_set['hostname'],
-    )
-    _recursively_enumerate_nameservers(
-        domain_name,
-        previous_ns_result=tld_ns_result,
+    _get_event_loop().run_until_complete(_enumerate_nameservers(domain_name))
+
+
+async def _is_apex_delegation_unchanged(apex_zone, parent_nameservers, ns_hostnames, glue):
+    """
+    Asks one of the parent zone's nameservers for the apex zone's NS records.
+
+    :returns: bool
+    False if the referral names other nameservers, has other glue,
+    or could not be fetched
+    """
+    nameserver_ip, nameserver_hostname = secrets.choice(parent_nameservers)
+    try:
+        ns_response = await _get_ns_response(
+            apex_zone,
+            nameserver_ip,
+            nameserver_hostname,
+            query_slots=asyncio.Semaphore(1),
+        )
+    except (
+        dns.resolver.NoNameservers,
+        dns.resolver.NXDOMAIN,
+        dns.resolver.Timeout,
+        dns.resolver.YXDOMAIN,
+    ):
+        return False
+    if ns_response.flags & dns.flags.AA:
+        return False
+
+    referred_ns_hostnames = {
+        str(rrset_value).lower()
+        for rrset in ns_response.authority
+        if (
+            rrset.rdtype == dns.rdatatype.NS
+            and
+            str(rrset.name).lower() == apex_zone
+        )
+        for rrset_value in rrset.items
+    }
+    if referred_ns_hostnames != set(ns_hostnames):
+        return False
+
+    referred_glue = {}
+    for rrset in ns_response.additional:
+        glue_hostname = str(rrset.name).lower()
+        if (
+            rrset.rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA)
+            and
+            glue_hostname in referred_ns_hostnames
+        ):
+            referred_glue.setdefault(glue_hostname, set()).update(
+                _get_usable_ips(str(rrset_value).lower() for rrset_value in rrset.items),
+            )
+    # Glue added, dropped or changed for any nameserver counts as a change
+    return {
+        glue_hostname: glue_ips
+        for glue_hostname, glue_ips in referred_glue.items()
+        if glue_ips
+    } == {
+        glue_hostname: set(glue_ips)
+        for glue_hostname, glue_ips in glue.items()
+        if glue_ips
+    }
+
+
+def is_apex_delegation_unchanged(apex_zone, parent_nameservers, ns_hostnames, glue):
+    """
+    A single query, to tell whether a target needs walking again, see incremental.py
+
+    :type apex_zone: string
+    e.g.
+        "foo.com."
+
+    :type parent_nameservers: list of (IP, hostname) pairs
+    Nameservers which referred to the apex zone last time
+
+    :type ns_hostnames: list of strings
+    The nameservers they referred to
+
+    :type glue: dictionary
+    Of nameserver hostname to the IPs the referral last had glue for
+    e.g.
+        {"ns1.foo.com.": ["1.2.3.4"], ...}
+
+    :returns: bool
+    """
+    return _get_event_loop().run_until_complete(
+        _is_apex_delegation_unchanged(apex_zone, parent_nameservers, ns_hostnames, glue),
     )
@@ -2,9 +2,6 @@ import json
 import platform
 import subprocess
 
-import boto3
-import pygraphviz
-
 from . import global_state
 from .constants import (
     BLUE,
@@ -14,9 +11,9 @@ from .constants import (
     YELLOW,
 )
 from .utils import (
-    get_available_base_domains,
-    get_nameservers_with_no_ip,
+    get_findings,
     is_authoritative,
+    is_problematic,
 )
 
 
@@ -26,15 +23,41 @@ PLATFORM_SYSTEM_TO_OPEN_COMMAND = {
 }
 
 
-def _draw_graph_from_cache(target_hostname):
+class _TrustGraph:
     """
-    Iterates through MASTER_DNS_CACHE, and calls _get_graph_data_for_ns_result()
+    An in-memory model of the graph, so every node and edge is
+    declared exactly once when it is serialized to DOT.
 
-    :returns: string
-    For pygraphviz.AGraph()
+    Attribute values are quoted when serialized, except HTML-like labels
+    which start with '<'.
     """
-    graph_data = (
-        f"""
+
+    def __init__(self):
+        # Node name to its attributes
+        self.nodes = {}
+        # (tail, head) to the edge's attributes
+        self.edges = {}
+
+    def add_node(self, name, **attributes):
+        """
+        Later attributes override earlier ones, as when a node is re-declared in DOT
+        """
+        self.nodes.setdefault(name, {}).update(attributes)
+
+    def add_edge(self, tail, head, **attributes):
+        """
+        Only the first edge between two nodes is kept
+        """
+        if (tail, head) not in self.edges:
+            self.edges[(tail, head)] = attributes
+
+    def to_dot(self, target_hostname):
+        """
+        :returns: string
+        For pygraphviz.AGraph()
+        """
+        graph_data = [
+            f"""
         digraph G {{
         graph [
             label=\"{target_hostname} DNS Trust Graph\",
@@ -46,133 +69,132 @@ def _draw_graph_from_cache(target_hostname):
         ];
         edge[arrowhead=vee, arrowtail=inv, arrowsize=.7]
         concentrate=true;
-        """
+        """,
+        ]
+        for (tail, head), attributes in self.edges.items():
+            graph_data.append(f'"{tail}" -> "{head}" {_format_attributes(attributes)};\n')
+        for name, attributes in self.nodes.items():
+            graph_data.append(f'"{name}" {_format_attributes(attributes)};\n')
+        graph_data.append('\n}')
+        return ''.join(graph_data)
+
+
+def _format_attributes(attributes):
+    """
+    :returns: string
+    e.g.
+        '[shape="ellipse", label=<<i>foo.</i>>]'
+    """
+    return '[{}]'.format(
+        ', '.join(
+            f'{key}={value}' if value.startswith('<') else f'{key}="{value}"'
+            for key, value in attributes.items()
+        ),
     )
 
+
+def _draw_graph_from_cache(target_hostname, findings):
+    """
+    Iterates through MASTER_DNS_CACHE once, calling _add_ns_result_edges(),
+    then annotates the nameservers with _add_nameserver_annotations()
+
+    :type findings: dictionary
+    As returned by get_findings() in utils.py
+
+    :returns: string
+    For pygraphviz.AGraph()
+    """
+    graph = _TrustGraph()
+
     for cache_key, ns_result in global_state.MASTER_DNS_CACHE.items():
         print(f"[ STATUS ] Building '{cache_key}'...")
-        for section_of_NS_answer in (
-            'additional_ns',
-            'authority_ns',
-            'answer_ns',
-        ):
-            graph_data += _get_graph_data_for_ns_result(
-                ns_list=ns_result[section_of_NS_answer],
+        for ns_records in ns_result.get_sections():
+            _add_ns_result_edges(
+                graph,
+                ns_records=ns_records,
                 ns_result=ns_result,
             )
 
-    graph_data += '\n}'
-    return graph_data
-
+    if global_state.MASTER_DNS_CACHE:
+        _add_nameserver_annotations(graph, findings)
 
-def _get_graph_data_for_ns_result(ns_list, ns_result):
-    return_graph_data_string = ''
-
-    for ns_rrset in ns_list:
-        potential_edge = (
-            f"{ns_result['nameserver_hostname']}->{ns_rrset['ns_hostname']}"
-        )
+    return graph.to_dot(target_hostname)
 
-        if potential_edge not in global_state.PREVIOUS_EDGES:
-            global_state.PREVIOUS_EDGES.add(potential_edge)
-            return_graph_data_string += (
-                '"{}" -> "{}" [shape=ellipse]'.format(
-                    ns_result['nameserver_hostname'],
-                    ns_rrset['ns_hostname'],
-                )
-            )
 
-            return_graph_data_string += (
-                '[label=<<i>{}?</i><br /><font point-size="10">{}</font>>] '.format(
-                    ns_result['hostname'],
-                    ns_result['rcode_string'],
-                )
-            )
+def _add_ns_result_edges(graph, ns_records, ns_result):
+    for ns_record in ns_records:
+        edge_attributes = {
+            'label': '<<i>{}?</i><br /><font point-size="10">{}</font>>'.format(
+                ns_result.hostname,
+                ns_result.rcode_string,
+            ),
+        }
+        if is_authoritative(ns_result.flags):
+            edge_attributes['color'] = BLUE
+        else:
+            edge_attributes['style'] = 'dashed'
+            edge_attributes['color'] = GRAY
 
-            if is_authoritative(ns_result['flags']):
-                return_graph_data_string += f'[color="{BLUE}"] '
-            else:
-                return_graph_data_string += f'[style="dashed", color="{GRAY}"] '
+        graph.add_edge(
+            ns_result.nameserver_hostname,
+            ns_record.ns_hostname,
+            **edge_attributes,
+        )
 
-            return_graph_data_string += ';\n'
 
+def _add_nameserver_annotations(graph, findings):
+    """
+    Each of these only depends on the scan as a whole, not on
+    any single cache entry, so is added once per graph
+    """
     # Make all nameservers which were specified with an AA flag blue
     for ns_hostname in global_state.AUTHORITATIVE_NS_LIST:
-        return_graph_data_string += (
-            f'"{ns_hostname}" [shape=ellipse, style=filled, fillcolor="{BLUE}"];\n'
-        )
+        graph.add_node(ns_hostname, shape='ellipse', style='filled', fillcolor=BLUE)
 
     # Make all nameservers without any IPs red because they are probably vulnerable
-    for ns_hostname in get_nameservers_with_no_ip():
-        return_graph_data_string += (
-            f'"{ns_hostname}" [shape=ellipse, style=filled, fillcolor="{RED}"];\n'
-        )
+    for ns_hostname in findings['nameservers_with_no_ip']:
+        graph.add_node(ns_hostname, shape='ellipse', style='filled', fillcolor=RED)
 
     # Make all nameservers with available base domains orange because they are probably vulnerable
-    for base_domain, ns_hostname in get_available_base_domains():
+    for base_domain, ns_hostname in findings['available_base_domains']:
         node_name = f"Base domain '{base_domain}' unregistered!"
-        potential_edge = f'{ns_hostname}->{node_name}'
-        if potential_edge not in global_state.PREVIOUS_EDGES:
-            global_state.PREVIOUS_EDGES.add(potential_edge)
-            return_graph_data_string += (
-                f'"{ns_hostname}" -> "{node_name}";\n'
-            )
-            return_graph_data_string += (
-                f'"{node_name}"[shape=octagon, style=filled, fillcolor="{ORANGE}"];\n'
-            )
+        graph.add_edge(ns_hostname, node_name)
+        graph.add_node(node_name, shape='octagon', style='filled', fillcolor=ORANGE)
 
     # Make nodes for DNS error states encountered like NXDOMAIN, Timeout, etc.
     for query_error in global_state.QUERY_ERROR_LIST:
-        potential_edge = (
-            f'{query_error["ns_hostname"]}->{query_error["error"]}'
+        graph.add_edge(
+            query_error['ns_hostname'],
+            query_error['error'],
+            label='<<i>{}?</i><br /><font point-size="10">{}</font>>'.format(
+                query_error['hostname'],
+                query_error['error'],
+            ),
         )
+        graph.add_node(query_error['error'], shape='octagon', style='filled', fillcolor=YELLOW)
 
-        if potential_edge not in global_state.PREVIOUS_EDGES:
-            global_state.PREVIOUS_EDGES.add(potential_edge)
-            return_graph_data_string += (
-                f'"{query_error["ns_hostname"]}" -> "{query_error["error"]}" '
-            )
-            return_graph_data_string += (
-                '[label=<<i>{}?</i><br /><font point-size="10">{}</font>>];\n'.format(
-                    query_error['hostname'],
-                    query_error['error'],
-                )
-            )
-            return_graph_data_string += (
-                '"{}" [shape=octagon, style=filled, fillcolor="{}"];\n'.format(
-                    query_error['error'],
-                    YELLOW,
-                )
-            )
-
-    return return_graph_data_string
 
-
-def generate_graph(
-    target_hostname,
+def render_graph(
+    graph_data,
+    output_graph_file,
     export_formats,
-    only_draw_problematic,
     open_graph_file,
     upload_args,
 ):
-    output_graph_file = f'./output/{target_hostname}_trust_tree_graph'
+    """
+    Lays the graph out once with dot, then writes that layout to every export format.
+
+    Runs in the render pool when there is one, see create_render_pool() in workers.py
+    """
+    # Imported here rather than at the top, as it is slow to load and many runs never graph
+    import pygraphviz
 
-    graph_data = _draw_graph_from_cache(target_hostname)
-    if (
-        only_draw_problematic
-        and
-        ORANGE not in graph_data
-        and
-        RED not in graph_data
-    ):
-        print(f'[ STATUS ] {target_hostname} is not problematic, skipping!')
-        return
-    # Render graph image
     grapher = pygraphviz.AGraph(graph_data)
+    grapher.layout(prog='dot')
 
     for export_format in export_formats:
         filename = f'{output_graph_file}.{export_format}'
-        grapher.draw(filename, prog='dot')
+        grapher.draw(filename)
         if open_graph_file:
             print('[ STATUS ] Opening final graph...')
             subprocess.call(
@@ -183,6 +205,8 @@ def generate_graph(
             )
         if upload_args:
             print('[ STATUS ] Uploading to AWS...')
+            import boto3
+
             prefix, bucket = upload_args.split(',')
             with open(global_state.AWS_CREDS_FILE, 'r') as f:
                 creds = json.load(f)
@@ -195,3 +219,49 @@ def generate_graph(
             client.upload_file(prefix+filename, bucket, filename)
 
     print('[ SUCCESS ] Finished generating graph!')
+
+
+def generate_graph(
+    target_hostname,
+    export_formats,
+    only_draw_problematic,
+    open_graph_file,
+    upload_args,
+    render_pool=None,
+    findings=None,
+):
+    """
+    :type render_pool: concurrent.futures.Executor
+    If given, the graph is rendered in the background
+
+    :type findings: dictionary
+    As returned by get_findings() in utils.py, which is called if not given
+
+    :returns: concurrent.futures.Future or None
+    The background render, if there is one
+    """
+    output_graph_file = f"./output/{target_hostname.rstrip('.')}_trust_tree_graph"
+
+    if findings is None:
+        findings = get_findings()
+    if (
+        only_draw_problematic
+        and
+        not is_problematic(findings)
+    ):
+        print(f'[ STATUS ] {target_hostname} is not problematic, skipping!')
+        return None
+
+    graph_data = _draw_graph_from_cache(target_hostname, findings)
+    render_args = (
+        graph_data,
+        output_graph_file,
+        export_formats,
+        open_graph_file,
+        upload_args,
+    )
+    if render_pool:
+        return render_pool.submit(render_graph, *render_args)
+
+    render_graph(*render_args)
+    return None
@@ -0,0 +1,63 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class FingerprintStore:
+    """
+    An SQLite file of each target's delegation fingerprint from the last
+    time it was walked, for --incremental, see incremental.py
+
+    Unlike SQLiteCache, fingerprints are kept once they expire, as the
+    next walk of the target is compared against them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # sqlite3 connections can not be shared between threads
+        self._thread_local = threading.local()
+
+    def _get_connection(self):
+        if not hasattr(self._thread_local, 'connection'):
+            connection = sqlite3.connect(self.path, timeout=30)
+            # Workers read while the main process writes
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS fingerprints ('
+                'hostname TEXT PRIMARY KEY, '
+                'expires_at REAL NOT NULL, '
+                'fingerprint TEXT NOT NULL'
+                ')'
+            )
+            connection.commit()
+            self._thread_local.connection = connection
+        return self._thread_local.connection
+
+    def get(self, target_hostname):
+        """
+        :returns: tuple (dictionary, bool) or None
+        The fingerprint, and whether it has expired, or None if the target
+        was never walked
+        """
+        row = self._get_connection().execute(
+            'SELECT expires_at, fingerprint FROM fingerprints WHERE hostname = ?',
+            (target_hostname,),
+        ).fetchone()
+        if row is None:
+            return None
+        expires_at, fingerprint = row
+        return (json.loads(fingerprint), expires_at <= time.time())
+
+    def set(self, target_hostname, fingerprint, ttl):
+        """
+        :type ttl: int
+        In seconds
+        """
+        connection = self._get_connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?)',
+            (target_hostname, time.time() + ttl, json.dumps(fingerprint)),
+        )
+        connection.commit()
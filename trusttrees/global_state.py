@@ -1,5 +1,18 @@
+import threading
 from collections import defaultdict
 
+from .constants import (
+    DEFAULT_MAX_IN_FLIGHT_QUERIES,
+    DEFAULT_MAX_QUERIES_PER_SECOND,
+    DEFAULT_MAX_QUERIES_PER_SERVER_PER_SECOND,
+    DEFAULT_QUERY_ATTEMPTS,
+    DEFAULT_QUERY_TIMEOUT,
+    DELEGATION_CACHE_MAX_ENTRIES,
+    DNS_PORT,
+    ROOT_SERVERS,
+)
+from .delegation_cache import DelegationCache
+
 
 AWS_CREDS_FILE = ''
 DNSIMPLE_ACCESS_TOKEN = ''
@@ -8,45 +21,131 @@ GANDI_API_V5_KEY = ''
 
 CHECK_DOMAIN_AVAILABILITY = True
 
-PREVIOUS_EDGES = set()
+# A local Public Suffix List file to use instead of the bundled one, see public_suffix.py
+PUBLIC_SUFFIX_LIST = None
+
+# Whether to look up, and query, the IPv6 addresses of nameservers
+IPV6_ENABLED = False
+
 RESOLVERS = []
 
-"""
-Saved results of DNS queries, key format is the following:
+# Where the walk starts, overridden with --root-servers, e.g. for benchmarks/
+ROOT_SERVERS = ROOT_SERVERS
+# Port every nameserver and resolver is queried on
+DNS_PORT = DNS_PORT
 
-KEY = FQDN_QUERY_NAME|QUERY_TYPE|NS_TARGET_IP
+# See enumerate_nameservers() in dns.py
+MAX_IN_FLIGHT_QUERIES = DEFAULT_MAX_IN_FLIGHT_QUERIES
+QUERY_TIMEOUT = DEFAULT_QUERY_TIMEOUT
+QUERY_ATTEMPTS = DEFAULT_QUERY_ATTEMPTS
+# Per worker, see rate_limiter.py
+MAX_QUERIES_PER_SECOND = DEFAULT_MAX_QUERIES_PER_SECOND
+MAX_QUERIES_PER_SERVER_PER_SECOND = DEFAULT_MAX_QUERIES_PER_SERVER_PER_SECOND
 
-e.g.
-    "google.com.|ns|192.168.1.1"
 """
-MASTER_DNS_CACHE = {}
-
+Referrals reused across every target in a run, see delegation_cache.py
 """
-This creates an easy map of nameserver names to one of their IP addresses.
+DELEGATION_CACHE = DelegationCache(max_entries=DELEGATION_CACHE_MAX_ENTRIES)
 
-It is used to check for nameservers without any IP addresses.
+"""
+Results saved to disk between runs when --cache-dir is given, see query_cache.py
+"""
+QUERY_CACHE = None
 
-e.g.
-    {
-        "ns1.example.com.": "192.168.1.1",
-        "ns2.example.com.": "",
-        ...
-    }
 """
-NS_IP_MAP = defaultdict(str)
+Registar availability results saved to disk between runs when --cache-dir
+is given, see availability_cache.py
+"""
+AVAILABILITY_CACHE = None
 
 """
-A simple list of nameservers which were returned with the authoritative answer flag set.
+Each target's delegation from the last run when --incremental is given,
+see incremental.py
+"""
+FINGERPRINT_STORE = None
 
-Used for graphing to make it clear where the flow of queries ends.
 
-We use a list instead of a set to preserve ordering slightly better.
-"""
-AUTHORITATIVE_NS_LIST = []
+class ScanState:
+    """
+    Everything collected while scanning a single target.
 
-"""
-A list of DNS errors returned whilst querying nameservers.
+    Each thread has its own ScanState, so worker threads can scan targets
+    at the same time. It is accessed through the upper-case module-level
+    names, e.g. global_state.MASTER_DNS_CACHE
+    """
 
-This is used in graphing to show where the flow breaks.
-"""
-QUERY_ERROR_LIST = []
+    def __init__(self):
+        """
+        Saved results of DNS queries, key format is the following:
+
+        KEY = FQDN_QUERY_NAME|QUERY_TYPE|NS_TARGET_IP|NS_TARGET_HOSTNAME
+
+        e.g.
+            "google.com.|ns|192.168.1.1|ns1.example.com."
+
+        Values are NSResult, see records.py
+        """
+        self.master_dns_cache = {}
+
+        """
+        This creates an easy map of nameserver names to all of their IP addresses.
+
+        It is used to check for nameservers without any IP addresses.
+
+        e.g.
+            {
+                "ns1.example.com.": ("192.168.1.1", "2001:db8::1"),
+                "ns2.example.com.": (),
+                ...
+            }
+        """
+        self.ns_ip_map = defaultdict(tuple)
+
+        """
+        A simple list of nameservers which were returned with the authoritative answer flag set.
+
+        Used for graphing to make it clear where the flow of queries ends.
+
+        We use a list instead of a set to preserve ordering slightly better.
+        """
+        self.authoritative_ns_list = []
+
+        """
+        A list of DNS errors returned whilst querying nameservers.
+
+        This is used in graphing to show where the flow breaks.
+        """
+        self.query_error_list = []
+
+
+_SCAN_STATE_ATTRIBUTES = {
+    'MASTER_DNS_CACHE': 'master_dns_cache',
+    'NS_IP_MAP': 'ns_ip_map',
+    'AUTHORITATIVE_NS_LIST': 'authoritative_ns_list',
+    'QUERY_ERROR_LIST': 'query_error_list',
+}
+_thread_local = threading.local()
+
+
+def get_scan_state():
+    """
+    :returns: ScanState
+    The state of the target being scanned in this thread
+    """
+    if not hasattr(_thread_local, 'scan_state'):
+        _thread_local.scan_state = ScanState()
+    return _thread_local.scan_state
+
+
+def set_scan_state(scan_state):
+    """
+    :type scan_state: ScanState
+    e.g. one returned by a worker, so it can be graphed
+    """
+    _thread_local.scan_state = scan_state
+
+
+def __getattr__(name):
+    if name in _SCAN_STATE_ATTRIBUTES:
+        return getattr(get_scan_state(), _SCAN_STATE_ATTRIBUTES[name])
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
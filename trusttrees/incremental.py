@@ -0,0 +1,195 @@
+"""
+For --incremental, which re-walks a target only when its delegation may
+have changed since the last run, and reports only what changed.
+
+A target's fingerprint is every zone cut seen while walking it, with the
+nameservers delegated to for each and their IPs. It expires with the
+shortest TTL of those NS records. Until then, a target is only walked
+again if the referral to its apex zone, asked of one of the parent zone's
+nameservers, no longer matches.
+"""
+import dns.name
+
+from . import global_state
+from .dns import is_apex_delegation_unchanged
+from .public_suffix import get_base_domain
+from .utils import is_authoritative
+
+
+def get_delegation_fingerprint(target_hostname):
+    """
+    Worked out from the current target's global_state.MASTER_DNS_CACHE
+
+    :returns: tuple (dictionary, int)
+    The fingerprint, and the shortest TTL of the NS records it came from
+    e.g.
+        (
+            {
+                "zones": {
+                    "com.": {"a.gtld-servers.net.": ["192.5.6.30"], ...},
+                    "foo.com.": {"ns1.foo.com.": ["1.2.3.4"], ...},
+                },
+                "apex": {
+                    "zone": "foo.com.",
+                    "parent_nameservers": [["192.5.6.30", "a.gtld-servers.net."], ...],
+                    "ns_hostnames": ["ns1.foo.com.", ...],
+                    "glue": {"ns1.foo.com.": ["1.2.3.4"], ...},
+                },
+            },
+            3600,
+        )
+    """
+    zones = {}
+    ttls = []
+    for ns_result in global_state.MASTER_DNS_CACHE.values():
+        if not ns_result.success:
+            continue
+        for ns_record in ns_result.authority_ns + ns_result.answer_ns:
+            zones.setdefault(ns_record.hostname, {})[ns_record.ns_hostname] = sorted(
+                global_state.NS_IP_MAP[ns_record.ns_hostname],
+            )
+            ttls.append(ns_record.ttl)
+
+    target_name = dns.name.from_text(target_hostname)
+    # Only zones at or under the target's registrable domain can be its apex.
+    # Otherwise, e.g. for a target that did not exist, the apex would be its
+    # TLD, whose referral does not change when the target is registered
+    base_domain = dns.name.from_text(get_base_domain(target_hostname) or target_hostname)
+    apex_zones = [
+        zone
+        for zone in zones
+        if (
+            target_name.is_subdomain(dns.name.from_text(zone))
+            and
+            dns.name.from_text(zone).is_subdomain(base_domain)
+        )
+    ]
+    apex = None
+    if apex_zones:
+        apex_zone = max(apex_zones, key=lambda zone: len(dns.name.from_text(zone)))
+        referrals = [
+            ns_result
+            for ns_result in global_state.MASTER_DNS_CACHE.values()
+            if (
+                ns_result.success
+                and
+                not is_authoritative(ns_result.flags)
+                and
+                any(ns_record.hostname == apex_zone for ns_record in ns_result.authority_ns)
+            )
+        ]
+        ns_hostnames = {
+            ns_record.ns_hostname
+            for ns_result in referrals
+            for ns_record in ns_result.authority_ns
+            if ns_record.hostname == apex_zone
+        }
+        glue = {}
+        for ns_result in referrals:
+            for ns_record in ns_result.additional_ns:
+                if ns_record.ns_hostname in ns_hostnames:
+                    glue.setdefault(ns_record.ns_hostname, set()).update(ns_record.ns_ips)
+        if referrals:
+            apex = {
+                'zone': apex_zone,
+                'parent_nameservers': sorted(
+                    {
+                        (ns_result.nameserver_ip, ns_result.nameserver_hostname)
+                        for ns_result in referrals
+                    }
+                ),
+                'ns_hostnames': sorted(ns_hostnames),
+                'glue': {
+                    ns_hostname: sorted(glue_ips)
+                    for ns_hostname, glue_ips in glue.items()
+                },
+            }
+
+    return (
+        {
+            'zones': zones,
+            'apex': apex,
+        },
+        min(ttls, default=0),
+    )
+
+
+def diff_fingerprints(before, after):
+    """
+    :type before: dictionary or None
+    None if the target was never walked
+
+    :returns: list of dictionaries
+    One per nameserver added to, removed from, or with other IPs for a zone,
+    with None for `before` or `after` where it was not delegated to
+    e.g.
+        [
+            {
+                "zone": "foo.com.",
+                "ns_hostname": "ns1.foo.com.",
+                "before": ["1.2.3.4"],
+                "after": None,
+            },
+        ]
+    """
+    before_zones = before['zones'] if before else {}
+    after_zones = after['zones']
+    changes = []
+    for zone in sorted(set(before_zones) | set(after_zones)):
+        before_ns_ips = before_zones.get(zone, {})
+        after_ns_ips = after_zones.get(zone, {})
+        for ns_hostname in sorted(set(before_ns_ips) | set(after_ns_ips)):
+            if before_ns_ips.get(ns_hostname) != after_ns_ips.get(ns_hostname):
+                changes.append(
+                    {
+                        'zone': zone,
+                        'ns_hostname': ns_hostname,
+                        'before': before_ns_ips.get(ns_hostname),
+                        'after': after_ns_ips.get(ns_hostname),
+                    },
+                )
+    return changes
+
+
+def is_unchanged_since_last_scan(target_hostname):
+    """
+    Called by workers before walking a target
+
+    :returns: bool
+    True if the target's fingerprint has not expired, and a fresh
+    referral to its apex zone matches it, glue included
+    """
+    last_scan = global_state.FINGERPRINT_STORE.get(target_hostname)
+    if last_scan is None:
+        return False
+    fingerprint, expired = last_scan
+    if (
+        expired
+        or
+        fingerprint['apex'] is None
+        or
+        # Saved before glue was
+        'glue' not in fingerprint['apex']
+    ):
+        return False
+
+    apex = fingerprint['apex']
+    return is_apex_delegation_unchanged(
+        apex['zone'],
+        [tuple(nameserver) for nameserver in apex['parent_nameservers']],
+        apex['ns_hostnames'],
+        apex['glue'],
+    )
+
+
+def update_fingerprint(target_hostname):
+    """
+    Saves the current target's fingerprint to global_state.FINGERPRINT_STORE
+
+    :returns: list of dictionaries
+    As returned by diff_fingerprints(), against the fingerprint it replaces
+    """
+    last_scan = global_state.FINGERPRINT_STORE.get(target_hostname)
+    fingerprint, ttl = get_delegation_fingerprint(target_hostname)
+    global_state.FINGERPRINT_STORE.set(target_hostname, fingerprint, ttl)
+    return diff_fingerprints(last_scan[0] if last_scan else None, fingerprint)
@@ -0,0 +1,132 @@
+import functools
+import os
+
+from . import global_state
+from .constants import BASE_DOMAIN_CACHE_MAX_ENTRIES
+
+# A snapshot of https://publicsuffix.org/list/public_suffix_list.dat,
+# shipped with the package so no lookup ever needs the network
+BUNDLED_PUBLIC_SUFFIX_LIST = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'public_suffix_list.dat',
+)
+
+
+class _SuffixNode:
+    __slots__ = ('children', 'is_suffix', 'is_exception')
+
+    def __init__(self):
+        # Label to _SuffixNode, '*' for a wildcard rule
+        self.children = {}
+        self.is_suffix = False
+        self.is_exception = False
+
+
+def _to_ascii(label):
+    """
+    Rules are written in Unicode, but nameserver hostnames come in
+    their xn-- form
+    """
+    if label == '*':
+        return label
+    try:
+        return label.encode('idna').decode('ascii')
+    except UnicodeError:
+        return label
+
+
+class PublicSuffixList:
+    """
+    The rules of a Public Suffix List file, in a trie of labels from the
+    TLD down, e.g. "*.kawasaki.jp" is under "jp" then "kawasaki".
+
+    Like tldextract's default, only the ICANN section is used, so e.g.
+    "foo.github.io." has a base domain of "github.io.".
+    """
+
+    def __init__(self, path):
+        self._root = _SuffixNode()
+        with open(path, encoding='utf-8') as rules:
+            for line in rules:
+                line = line.strip()
+                if line.startswith('// ===END ICANN DOMAINS==='):
+                    break
+                if (
+                    not line
+                    or
+                    line.startswith('//')
+                ):
+                    continue
+                # Rules end at the first whitespace
+                self._add_rule(line.split()[0])
+
+        # Nameserver hostnames repeat across targets, so answers are memoized
+        self.get_base_domain = functools.lru_cache(
+            maxsize=BASE_DOMAIN_CACHE_MAX_ENTRIES,
+        )(self._get_base_domain)
+
+    def _add_rule(self, rule):
+        is_exception = rule.startswith('!')
+        node = self._root
+        for label in reversed(rule.lstrip('!').lower().split('.')):
+            node = node.children.setdefault(_to_ascii(label), _SuffixNode())
+        if is_exception:
+            node.is_exception = True
+        else:
+            node.is_suffix = True
+
+    def _get_suffix_length(self, labels):
+        """
+        :type labels: list of strings
+        From the TLD down, e.g. ["uk", "co", "foo"]
+
+        :returns: int
+        How many of the labels are the public suffix
+        """
+        # An unlisted TLD is still a public suffix, as the "*" rule
+        suffix_length = 1
+        node = self._root
+        for i, label in enumerate(labels):
+            if '*' in node.children:
+                suffix_length = i + 1
+            node = node.children.get(label)
+            if node is None:
+                break
+            if node.is_exception:
+                # e.g. "!www.ck" makes "ck" the suffix of "www.ck."
+                suffix_length = i
+                break
+            if node.is_suffix:
+                suffix_length = i + 1
+        return suffix_length
+
+    def _get_base_domain(self, hostname):
+        labels = hostname.lower().rstrip('.').split('.')
+        labels.reverse()
+        suffix_length = self._get_suffix_length(labels)
+        if len(labels) <= suffix_length:
+            return None
+        return '.'.join(reversed(labels[:suffix_length + 1])) + '.'
+
+
+@functools.lru_cache(maxsize=None)
+def _load_public_suffix_list(path):
+    return PublicSuffixList(path)
+
+
+def get_base_domain(hostname):
+    """
+    Uses the --public-suffix-list file if given, or else the bundled one.
+
+    :type hostname: string
+    e.g.
+        "ns2.foo.co.uk."
+
+    :returns: string or None
+    None if the hostname is itself a public suffix
+    e.g.
+        "foo.co.uk."
+    """
+    return _load_public_suffix_list(
+        global_state.PUBLIC_SUFFIX_LIST or BUNDLED_PUBLIC_SUFFIX_LIST,
+    ).get_base_domain(hostname)
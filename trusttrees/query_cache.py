@@ -0,0 +1,59 @@
+from .records import NSResult
+from .sqlite_cache import SQLiteCache
+
+
+class QueryCache(SQLiteCache):
+    """
+    An on-disk store of _ns_query() results, so an interrupted or repeated
+    scan does not have to fetch them again.
+
+    Keys are the same as global_state.MASTER_DNS_CACHE keys, e.g.
+        "google.com.|ns|192.168.1.1|ns1.example.com."
+
+    Only answers which a later run could trust are stored: successful
+    responses, which expire after their smallest TTL, and NXDOMAIN/YXDOMAIN,
+    which expire after `negative_ttl`. Timeouts and other failures are
+    always retried.
+    """
+
+    # Changed whenever the format of _ns_query() results changes
+    FILENAME = 'query_cache.v2.sqlite3'
+
+    def __init__(self, cache_dir, max_entries, negative_ttl):
+        super().__init__(cache_dir, max_entries)
+        self.negative_ttl = negative_ttl
+
+    def _get_ttl(self, ns_result):
+        """
+        :returns: int or None
+        None if the result should not be stored
+        """
+        if not ns_result.success:
+            if ns_result.rcode_string in ('NXDOMAIN', 'YXDOMAIN'):
+                return self.negative_ttl
+            return None
+
+        ttls = [
+            ns_record.ttl
+            for ns_records in ns_result.get_sections()
+            for ns_record in ns_records
+        ]
+        if not ttls:
+            return self.negative_ttl
+        return min(ttls)
+
+    def get(self, cache_key):
+        """
+        :returns: NSResult or None
+        As returned by _ns_query() in dns.py
+        """
+        ns_result_dict = self.get_value(cache_key)
+        if ns_result_dict is None:
+            return None
+        return NSResult.from_dict(ns_result_dict)
+
+    def set(self, cache_key, ns_result):
+        ttl = self._get_ttl(ns_result)
+        if ttl is not None:
+            # Stored in the same format as --jsonl
+            self.set_value(cache_key, ns_result.to_dict(), ttl)
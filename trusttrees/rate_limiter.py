@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+from .constants import (
+    MIN_QUERIES_PER_SERVER_PER_SECOND,
+    RATE_LIMIT_DECREASE_INTERVAL,
+)
+
+
+class _TokenBucket:
+    __slots__ = ('rate', 'tokens', 'updated')
+
+    def __init__(self, rate, now):
+        self.rate = rate
+        # Up to one second's worth of queries can be sent in a burst
+        self.tokens = rate
+        self.updated = now
+
+    def reserve(self, now):
+        """
+        Takes a token, which may not have been refilled yet
+
+        :returns: float
+        Seconds to wait until the token can be used
+        """
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+class _ServerLimit:
+    __slots__ = ('bucket', 'last_decrease')
+
+    def __init__(self, rate, now):
+        self.bucket = _TokenBucket(rate, now)
+        self.last_decrease = now - RATE_LIMIT_DECREASE_INTERVAL
+
+
+class RateLimiter:
+    """
+    Caps how many queries per second are sent in total, and to each
+    nameserver IP.
+
+    A nameserver's rate is halved when its queries time out, at most once
+    every RATE_LIMIT_DECREASE_INTERVAL seconds so a burst of timeouts only
+    counts once, and creeps back up by one query per second for every answer.
+    This way a nameserver which drops us for sending too fast is slowed
+    down, rather than being reported as a TIMEOUT.
+
+    Recursive resolvers are built to take heavy load, so queries to them
+    only count towards the total.
+    """
+
+    def __init__(self, max_queries_per_second, max_queries_per_server_per_second, resolvers):
+        self.max_queries_per_server_per_second = max_queries_per_server_per_second
+        self.resolvers = frozenset(resolvers)
+        self._bucket = _TokenBucket(max_queries_per_second, time.monotonic())
+        # Nameserver IP to _ServerLimit
+        self._server_limits = {}
+
+    def _get_server_limit(self, nameserver_ip, now):
+        if nameserver_ip not in self._server_limits:
+            self._server_limits[nameserver_ip] = _ServerLimit(
+                self.max_queries_per_server_per_second,
+                now,
+            )
+        return self._server_limits[nameserver_ip]
+
+    async def wait(self, nameserver_ip):
+        """
+        Returns once a query can be sent to `nameserver_ip`
+        """
+        now = time.monotonic()
+        delay = self._bucket.reserve(now)
+        if nameserver_ip not in self.resolvers:
+            delay = max(
+                delay,
+                self._get_server_limit(nameserver_ip, now).bucket.reserve(now),
+            )
+        if delay:
+            await asyncio.sleep(delay)
+
+    def record_answer(self, nameserver_ip):
+        if nameserver_ip in self.resolvers:
+            return
+        bucket = self._server_limits[nameserver_ip].bucket
+        bucket.rate = min(bucket.rate + 1, self.max_queries_per_server_per_second)
+
+    def record_timeout(self, nameserver_ip):
+        if nameserver_ip in self.resolvers:
+            return
+        now = time.monotonic()
+        server_limit = self._server_limits[nameserver_ip]
+        if now - server_limit.last_decrease < RATE_LIMIT_DECREASE_INTERVAL:
+            return
+        server_limit.last_decrease = now
+        server_limit.bucket.rate = max(
+            server_limit.bucket.rate / 2,
+            # Backing off never raises a cap already below the floor
+            min(MIN_QUERIES_PER_SERVER_PER_SECOND, self.max_queries_per_server_per_second),
+        )
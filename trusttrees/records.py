@@ -0,0 +1,210 @@
+import copy
+
+from .constants import SYMBOL_TABLE_MAX_ENTRIES
+
+
+"""
+Every hostname, IP and flag seen in this run, to itself.
+
+The same nameserver names and addresses appear in the results of many
+targets, so each is kept as one shared string rather than a copy per result.
+"""
+_SYMBOLS = {}
+
+
+def intern_symbol(string):
+    """
+    :returns: string
+    The copy of `string` shared by every result in this run
+    """
+    symbol = _SYMBOLS.get(string)
+    if symbol is None:
+        if len(_SYMBOLS) >= SYMBOL_TABLE_MAX_ENTRIES:
+            # e.g. for --serve, strings already shared stay shared
+            _SYMBOLS.clear()
+        symbol = _SYMBOLS.setdefault(string, string)
+    return symbol
+
+
+class NSRecord:
+    """
+    One nameserver from a section of an NS response
+    """
+
+    __slots__ = ('ns_hostname', 'ns_ips', 'ttl', 'hostname')
+
+    def __init__(self, ns_hostname, ns_ips, ttl, hostname=None):
+        # e.g. "ns1.foo.com."
+        self.ns_hostname = ns_hostname
+        # Tuple of strings, empty if no address was found
+        self.ns_ips = ns_ips
+        self.ttl = ttl
+        # The zone the nameserver is for, e.g. "foo.com.", None for glue
+        self.hostname = hostname
+
+    def to_dict(self):
+        """
+        :returns: dictionary
+        e.g.
+            {
+                'ns_hostname': 'demand.alpha.aridns.net.au.',
+                'ttl': 172800,
+                'hostname': 'foo.',
+                'ns_ips': ['5.6.7.8'],
+            }
+        """
+        ns_dict = {
+            'ns_hostname': self.ns_hostname,
+            'ttl': self.ttl,
+        }
+        if self.hostname is not None:
+            ns_dict['hostname'] = self.hostname
+        if self.ns_ips:
+            ns_dict['ns_ips'] = list(self.ns_ips)
+        return ns_dict
+
+    @classmethod
+    def from_dict(cls, ns_dict):
+        """
+        :type ns_dict: dictionary
+        As returned by to_dict()
+        """
+        hostname = ns_dict.get('hostname')
+        return cls(
+            ns_hostname=intern_symbol(ns_dict['ns_hostname']),
+            ns_ips=tuple(intern_symbol(ns_ip) for ns_ip in ns_dict.get('ns_ips', ())),
+            ttl=ns_dict['ttl'],
+            hostname=intern_symbol(hostname) if hostname is not None else None,
+        )
+
+
+class NSResult:
+    """
+    The result of asking one nameserver for the NS records of a hostname,
+    as returned by _ns_query() in dns.py
+
+    Results are shared between targets by the caches, so are not changed
+    once made.
+    """
+
+    __slots__ = (
+        'hostname',
+        'nameserver_hostname',
+        'nameserver_ip',
+        'additional_ns',
+        'authority_ns',
+        'answer_ns',
+        'flags',
+        'success',
+        'rcode',
+        'rcode_string',
+    )
+
+    def __init__(
+        self,
+        hostname,
+        nameserver_hostname,
+        nameserver_ip,
+        rcode,
+        rcode_string,
+        success=False,
+        flags=(),
+        additional_ns=(),
+        authority_ns=(),
+        answer_ns=(),
+    ):
+        self.hostname = hostname
+        self.nameserver_hostname = nameserver_hostname
+        self.nameserver_ip = nameserver_ip
+        # Each a tuple of NSRecord
+        self.additional_ns = additional_ns
+        self.authority_ns = authority_ns
+        self.answer_ns = answer_ns
+        # Tuple of strings, e.g. ("QR", "AA")
+        self.flags = flags
+        self.success = success
+        # -1 for timeouts and other failures with no response code
+        self.rcode = rcode
+        # e.g. "NOERROR" or "TIMEOUT"
+        self.rcode_string = rcode_string
+
+    def get_sections(self):
+        """
+        :returns: tuple of tuples of NSRecord
+        The additional, authority and answer sections
+        """
+        return (self.additional_ns, self.authority_ns, self.answer_ns)
+
+    def with_nameserver_hostname(self, nameserver_hostname):
+        """
+        :returns: NSResult
+        A copy, sharing the sections, as if `nameserver_hostname` was asked
+        """
+        ns_result = copy.copy(self)
+        ns_result.nameserver_hostname = nameserver_hostname
+        return ns_result
+
+    def to_dict(self):
+        """
+        For JSON, e.g. --jsonl and the query cache
+
+        :returns: dictionary
+        e.g.
+             {
+                 'hostname': 'bar.foo.',
+                 'nameserver_hostname': 'g.root-servers.net.',
+                 'nameserver_ip': '1.2.3.4',
+                 'additional_ns': [],
+                 'authority_ns': [
+                     {
+                         'ns_hostname': 'demand.alpha.aridns.net.au.',
+                         'ttl': 172800,
+                         'hostname': 'foo.',
+                         'ns_ips': ['5.6.7.8'],
+                     },
+                     ...
+                 ],
+                 'answer_ns': [],
+                 'flags': ['QR', 'RD'],
+                 'success': True,
+                 'rcode': 0,
+                 'rcode_string': 'NOERROR',
+            }
+        """
+        return {
+            'hostname': self.hostname,
+            'nameserver_hostname': self.nameserver_hostname,
+            'nameserver_ip': self.nameserver_ip,
+            'additional_ns': [ns_record.to_dict() for ns_record in self.additional_ns],
+            'authority_ns': [ns_record.to_dict() for ns_record in self.authority_ns],
+            'answer_ns': [ns_record.to_dict() for ns_record in self.answer_ns],
+            'flags': list(self.flags),
+            'success': self.success,
+            'rcode': self.rcode,
+            'rcode_string': self.rcode_string,
+        }
+
+    @classmethod
+    def from_dict(cls, ns_result_dict):
+        """
+        :type ns_result_dict: dictionary
+        As returned by to_dict()
+        """
+        return cls(
+            hostname=intern_symbol(ns_result_dict['hostname']),
+            nameserver_hostname=intern_symbol(ns_result_dict['nameserver_hostname']),
+            nameserver_ip=intern_symbol(ns_result_dict['nameserver_ip']),
+            rcode=ns_result_dict['rcode'],
+            rcode_string=intern_symbol(ns_result_dict['rcode_string']),
+            success=ns_result_dict['success'],
+            flags=tuple(intern_symbol(flag) for flag in ns_result_dict['flags']),
+            additional_ns=tuple(
+                NSRecord.from_dict(ns_dict) for ns_dict in ns_result_dict['additional_ns']
+            ),
+            authority_ns=tuple(
+                NSRecord.from_dict(ns_dict) for ns_dict in ns_result_dict['authority_ns']
+            ),
+            answer_ns=tuple(
+                NSRecord.from_dict(ns_dict) for ns_dict in ns_result_dict['answer_ns']
+            ),
+        )
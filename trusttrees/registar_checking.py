@@ -1,55 +1,85 @@
+import concurrent.futures
+import functools
 import json
+import threading
 import time
-import xmlrpc.client
-
-import boto3
-import dnsimple
-import requests
 
 from . import global_state
+from .constants import (
+    MAX_CONCURRENT_REGISTAR_CHECKS,
+    REGISTAR_PENDING_DEADLINE,
+    REGISTAR_PENDING_INITIAL_BACKOFF,
+    REGISTAR_PENDING_MAX_BACKOFF,
+)
 
 
+"""
+Domain, without a trailing '.', to a concurrent.futures.Future of bool
+"""
 DOMAIN_AVAILABILITY_CACHE = {}
-gandi_api_v4 = xmlrpc.client.ServerProxy(
-    uri='https://rpc.gandi.net/xmlrpc/',
-)
 
+# Each registar's client library is imported by the first check that uses
+# it, as loading them all is slow, and most runs use one or none of them
 
-def _auto_retry(registar_function):
-    """
-    :type registar_function: function
-    Returns a lowercase availability status when given a domain
 
-    :returns: function
-    A wrapped registar_function that retries and returns a bool
-    """
-    def wrapper_of_registar_function(input_domain):
-        for _ in range(10):
-            status = registar_function(input_domain)
-            if status != 'pending':
-                break
-            time.sleep(1)
+@functools.lru_cache(maxsize=None)
+def _get_gandi_api_v4_proxy():
+    import xmlrpc.client
+
+    return xmlrpc.client.ServerProxy(
+        uri='https://rpc.gandi.net/xmlrpc/',
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _get_gandi_api_v5_session():
+    import requests
 
-        return status.startswith('available')
+    session = requests.Session()
+    session.headers['Authorization'] = f'Apikey {global_state.GANDI_API_V5_KEY}'
+    return session
 
-    return wrapper_of_registar_function
 
+@functools.lru_cache(maxsize=None)
+def _get_aws_route53domains_client():
+    import boto3
+
+    with open(global_state.AWS_CREDS_FILE, 'r') as f:
+        creds = json.load(f)
+    return boto3.client(
+        'route53domains',
+        aws_access_key_id=creds['accessKeyId'],
+        aws_secret_access_key=creds['secretAccessKey'],
+        region_name='us-east-1',  # Only region available
+    )
 
-@_auto_retry
-def _can_register_with_gandi_api_v4(input_domain):
+
+@functools.lru_cache(maxsize=None)
+def _get_dnsimple_client_and_account_id():
     """
-    :returns: lowercase string
-    availability status returned from the API
+    :returns: tuple (dnsimple.Client, int)
+    """
+    import dnsimple
+
+    client = dnsimple.Client(access_token=global_state.DNSIMPLE_ACCESS_TOKEN)
+    account_id = client.identity.whoami().data.account.id
+    return (client, account_id)
+
+
+def _get_statuses_with_gandi_api_v4(input_domains):
+    """
+    domain.available takes a list, so every domain is checked in one call
+
+    :returns: dictionary
+    Of domain to the lowercase availability status returned from the API
     """
-    status = gandi_api_v4.domain.available(
+    return _get_gandi_api_v4_proxy().domain.available(
         global_state.GANDI_API_V4_KEY,
-        [input_domain],
-    )[input_domain]
-    return status
+        list(input_domains),
+    )
 
 
-@_auto_retry
-def _can_register_with_gandi_api_v5(input_domain):
+def _get_status_with_gandi_api_v5(input_domain):
     """
     For more information, please see
     https://api.gandi.net/docs/domains/
@@ -57,14 +87,11 @@ def _can_register_with_gandi_api_v5(input_domain):
     :returns: lowercase string
     availability status returned from the API
     """
-    response = requests.get(
+    response = _get_gandi_api_v5_session().get(
         url='https://api.gandi.net/v5/domain/check',
         params={
             'name': input_domain,
         },
-        headers={
-            'Authorization': f'Apikey {global_state.GANDI_API_V5_KEY}',
-        },
     )
     assert response.status_code == 200
 
@@ -79,69 +106,272 @@ def _can_register_with_gandi_api_v5(input_domain):
     return status
 
 
-@_auto_retry
-def _can_register_with_aws_boto3(input_domain):
+def _get_status_with_aws_boto3(input_domain):
     """
     :returns: lowercase string
     availability status returned from the API
     """
-    with open(global_state.AWS_CREDS_FILE, 'r') as f:
-        creds = json.load(f)
-    client = boto3.client(
-        'route53domains',
-        aws_access_key_id=creds['accessKeyId'],
-        aws_secret_access_key=creds['secretAccessKey'],
-        region_name='us-east-1',  # Only region available
-    )
-    status = client.check_domain_availability(
+    status = _get_aws_route53domains_client().check_domain_availability(
         DomainName=input_domain,
     )['Availability']
     return status.lower()
 
 
-def _can_register_with_dnsimple_api_v2(input_domain):
+def _get_status_with_dnsimple_api_v2(input_domain):
     """
     For more information, please see
     https://developer.dnsimple.com/v2/registrar/#checkDomain
 
-    :returns bool
-    availability status returned from the API
+    :returns: lowercase string
+    'available' or 'unavailable'
     """
-    client = dnsimple.Client(access_token=global_state.DNSIMPLE_ACCESS_TOKEN)
-    account_id = client.identity.whoami().data.account.id
+    client, account_id = _get_dnsimple_client_and_account_id()
     response = client.registrar.check_domain(account_id, input_domain)
-    return response.data.available
+    return 'available' if response.data.available else 'unavailable'
 
 
-def is_domain_available(input_domain):
+def _get_statuses(input_domains):
     """
-    Called if Gandi API key, DNSimple token, or AWS credentials file
-    is provided.
+    Uses whichever registar API we were given credentials for,
+    checking up to MAX_CONCURRENT_REGISTAR_CHECKS domains at once.
 
-    Note that we do not do `lru_cache(maxsize=0)` but instead
-    use our own cache. This is because we normalize input when
-    removing any trailing '.' characters.
+    :returns: dictionary
+    Of domain to the lowercase availability status returned from the API,
+    or to the exception raised while checking it alone
+    """
+    if global_state.GANDI_API_V4_KEY:
+        return _get_statuses_with_gandi_api_v4(input_domains)
 
-    :returns: bool
+    if global_state.GANDI_API_V5_KEY:
+        _get_status_function = _get_status_with_gandi_api_v5
+        _get_gandi_api_v5_session()
+    elif global_state.DNSIMPLE_ACCESS_TOKEN:
+        _get_status_function = _get_status_with_dnsimple_api_v2
+        _get_dnsimple_client_and_account_id()
+    else:
+        _get_status_function = _get_status_with_aws_boto3
+        _get_aws_route53domains_client()
+
+    # The client is created above, before it is shared between threads
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=MAX_CONCURRENT_REGISTAR_CHECKS,
+    ) as executor:
+        status_futures = {
+            input_domain: executor.submit(_get_status_function, input_domain)
+            for input_domain in input_domains
+        }
+    statuses = {}
+    for input_domain, status_future in status_futures.items():
+        # One failed check does not fail the rest
+        statuses[input_domain] = status_future.exception() or status_future.result()
+    return statuses
+
+
+class _OutstandingCheck:
+    __slots__ = ('future', 'next_check', 'backoff', 'deadline')
+
+    def __init__(self, now):
+        self.future = concurrent.futures.Future()
+        self.next_check = now
+        self.backoff = REGISTAR_PENDING_INITIAL_BACKOFF
+        # Set once the domain is first reported as 'pending'
+        self.deadline = None
+
+
+class _StatusPollScheduler:
     """
-    if input_domain.endswith('.'):
-        input_domain = input_domain[:-1]
+    Checks domains in a background thread, so scanning and graphing carry on meanwhile.
+
+    Every domain that is due is checked in one batch. Domains a registar
+    reports as 'pending' are re-checked together with exponential backoff,
+    until they resolve or REGISTAR_PENDING_DEADLINE seconds pass, after
+    which they are treated as unavailable. A domain whose check fails has
+    the error set on its future alone, and is dropped from
+    DOMAIN_AVAILABILITY_CACHE so a later check tries it again.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        # Domain to _OutstandingCheck
+        self._outstanding = {}
+        self._thread = None
+
+    def submit(self, input_domains):
+        """
+        :returns: dictionary
+        Of domain to concurrent.futures.Future of bool
+        """
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            now = time.monotonic()
+            futures = {}
+            for input_domain in input_domains:
+                # e.g. submitted by another thread meanwhile
+                if input_domain not in self._outstanding:
+                    self._outstanding[input_domain] = _OutstandingCheck(now)
+                futures[input_domain] = self._outstanding[input_domain].future
+            # Cached while the lock is held, so a failed check is never left cached
+            DOMAIN_AVAILABILITY_CACHE.update(futures)
+            self._condition.notify()
+            return futures
+
+    def _get_due_domains(self):
+        """
+        Blocks until at least one domain is due to be checked
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                due_domains = [
+                    input_domain
+                    for input_domain, check in self._outstanding.items()
+                    if check.next_check <= now
+                ]
+                if due_domains:
+                    return due_domains
+                if self._outstanding:
+                    self._condition.wait(
+                        timeout=min(
+                            check.next_check
+                            for check in self._outstanding.values()
+                        ) - now,
+                    )
+                else:
+                    self._condition.wait()
+
+    def _fail_check(self, input_domain, exception):
+        """
+        Must be called with self._condition held.
+
+        The failed check is forgotten, so a later one can try the domain again.
+        """
+        check = self._outstanding.pop(input_domain)
+        if DOMAIN_AVAILABILITY_CACHE.get(input_domain) is check.future:
+            del DOMAIN_AVAILABILITY_CACHE[input_domain]
+        check.future.set_exception(exception)
+
+    def _update_check(self, input_domain, status, now):
+        """
+        Must be called with self._condition held.
+        """
+        if status is None:
+            raise LookupError(f'No availability status was returned for {input_domain}')
+        if isinstance(status, Exception):
+            raise status
+
+        check = self._outstanding[input_domain]
+        if status == 'pending':
+            if check.deadline is None:
+                check.deadline = now + REGISTAR_PENDING_DEADLINE
+            if now < check.deadline:
+                check.next_check = min(now + check.backoff, check.deadline)
+                check.backoff = min(check.backoff * 2, REGISTAR_PENDING_MAX_BACKOFF)
+                return
+        del self._outstanding[input_domain]
+        domain_available = status.startswith('available')
+        check.future.set_result(domain_available)
+        # Still-pending domains are left for the next run to check again
+        if (
+            global_state.AVAILABILITY_CACHE
+            and
+            status != 'pending'
+        ):
+            global_state.AVAILABILITY_CACHE.set(input_domain, domain_available)
+
+    def _run(self):
+        while True:
+            due_domains = self._get_due_domains()
+            try:
+                statuses = _get_statuses(due_domains)
+            except Exception as e:
+                statuses = dict.fromkeys(due_domains, e)
+
+            now = time.monotonic()
+            with self._condition:
+                for input_domain in due_domains:
+                    try:
+                        self._update_check(input_domain, statuses.get(input_domain), now)
+                    except Exception as e:
+                        # e.g. the registar left the domain out of its reply
+                        if input_domain in self._outstanding:
+                            self._fail_check(input_domain, e)
+
+
+_status_poll_scheduler = _StatusPollScheduler()
+
+
+def start_availability_checks(input_domains):
+    """
+    Called if Gandi API key, DNSimple token, or AWS credentials file
+    is provided.
 
-    if input_domain in DOMAIN_AVAILABILITY_CACHE:
-        return DOMAIN_AVAILABILITY_CACHE[input_domain]
+    Starts checking every domain not already in DOMAIN_AVAILABILITY_CACHE,
+    or saved in global_state.AVAILABILITY_CACHE by a previous run, without
+    waiting for the results. Note that we normalize input by removing any
+    trailing '.' characters.
 
-    print(f'[ STATUS ] Checking if {input_domain} is available...')
+    :type input_domains: iterable of strings
 
-    if global_state.GANDI_API_V4_KEY:
-        _can_register_function = _can_register_with_gandi_api_v4
-    elif global_state.GANDI_API_V5_KEY:
-        _can_register_function = _can_register_with_gandi_api_v5
-    elif global_state.DNSIMPLE_ACCESS_TOKEN:
-        _can_register_function = _can_register_with_dnsimple_api_v2
-    else:
-        _can_register_function = _can_register_with_aws_boto3
+    :returns: dictionary
+    Of each input domain, as given, to concurrent.futures.Future of bool
+    """
+    normalized_domains = {
+        input_domain: input_domain[:-1] if input_domain.endswith('.') else input_domain
+        for input_domain in input_domains
+    }
+
+    # Failed checks are dropped from DOMAIN_AVAILABILITY_CACHE by the
+    # scheduler's thread, so the futures are kept here as they are found
+    futures = {}
+    domains_to_check = []
+    for normalized_domain in normalized_domains.values():
+        if normalized_domain in futures:
+            continue
+        future = DOMAIN_AVAILABILITY_CACHE.get(normalized_domain)
+        if future is not None:
+            futures[normalized_domain] = future
+            continue
+
+        if global_state.AVAILABILITY_CACHE:
+            domain_available = global_state.AVAILABILITY_CACHE.get(normalized_domain)
+            if domain_available is not None:
+                future = concurrent.futures.Future()
+                future.set_result(domain_available)
+                DOMAIN_AVAILABILITY_CACHE[normalized_domain] = future
+                futures[normalized_domain] = future
+                continue
+
+        print(f'[ STATUS ] Checking if {normalized_domain} is available...')
+        futures[normalized_domain] = None
+        domains_to_check.append(normalized_domain)
+
+    if domains_to_check:
+        # Futures are cached, so targets sharing a domain share its check
+        futures.update(_status_poll_scheduler.submit(domains_to_check))
+
+    return {
+        input_domain: futures[normalized_domain]
+        for input_domain, normalized_domain in normalized_domains.items()
+    }
+
+
+def are_domains_available(input_domains):
+    """
+    Waits for start_availability_checks()
+
+    :returns: dictionary
+    Of each input domain, as given, to bool
+    """
+    return {
+        input_domain: future.result()
+        for input_domain, future in start_availability_checks(input_domains).items()
+    }
 
-    domain_available = _can_register_function(input_domain)
-    DOMAIN_AVAILABILITY_CACHE[input_domain] = domain_available
 
-    return domain_available
+def is_domain_available(input_domain):
+    """
+    :returns: bool
+    """
+    return are_domains_available([input_domain])[input_domain]
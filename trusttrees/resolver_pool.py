@@ -0,0 +1,119 @@
+import random
+import time
+
+from .constants import (
+    INITIAL_RESOLVER_HEDGE_DELAY,
+    MIN_RESOLVER_HEDGE_DELAY,
+    RESOLVER_EJECTION_FAILURES,
+    RESOLVER_EJECTION_TIME,
+)
+
+
+class _ResolverHealth:
+    __slots__ = ('latency', 'failure_rate', 'consecutive_failures', 'ejected_until')
+
+    def __init__(self):
+        # In seconds, None until the first answer
+        self.latency = None
+        self.failure_rate = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+
+class ResolverPool:
+    """
+    Chooses which of the --resolvers to send a lookup to.
+
+    Each resolver's latency and failure rate are tracked, and the better
+    of two randomly picked resolvers is chosen, so lookups lean towards
+    healthy resolvers without all landing on one. A resolver which fails
+    RESOLVER_EJECTION_FAILURES lookups in a row is not chosen for
+    RESOLVER_EJECTION_TIME seconds.
+
+    get_hedge_delay() says how long to wait on a resolver before also
+    asking another one.
+    """
+
+    def __init__(self, resolvers):
+        # Resolver IP to _ResolverHealth
+        self._resolvers = {
+            resolver: _ResolverHealth()
+            for resolver in resolvers
+        }
+
+    def _get_score(self, resolver):
+        """
+        Lower is better
+
+        :returns: float
+        Expected seconds per answer
+        """
+        health = self._resolvers[resolver]
+        if health.latency is None:
+            latency = INITIAL_RESOLVER_HEDGE_DELAY / 2
+        else:
+            latency = health.latency
+        return latency / max(1 - health.failure_rate, 0.05)
+
+    def choose(self, exclude=()):
+        """
+        :type exclude: collection of strings
+        Resolvers already being asked
+
+        :returns: string or None
+        None if there is no other resolver to choose
+        """
+        now = time.monotonic()
+        candidates = [
+            resolver
+            for resolver, health in self._resolvers.items()
+            if (
+                resolver not in exclude
+                and
+                health.ejected_until <= now
+            )
+        ]
+        if not candidates:
+            # Every resolver is ejected, so carry on with all of them
+            candidates = [
+                resolver
+                for resolver in self._resolvers
+                if resolver not in exclude
+            ]
+        if not candidates:
+            return None
+        return min(
+            random.sample(candidates, min(len(candidates), 2)),
+            key=self._get_score,
+        )
+
+    def get_hedge_delay(self, resolver):
+        """
+        :returns: float
+        In seconds
+        """
+        latency = self._resolvers[resolver].latency
+        if latency is None:
+            return INITIAL_RESOLVER_HEDGE_DELAY
+        return max(2 * latency, MIN_RESOLVER_HEDGE_DELAY)
+
+    def record_answer(self, resolver, latency):
+        """
+        :type latency: float
+        In seconds
+        """
+        health = self._resolvers[resolver]
+        if health.latency is None:
+            health.latency = latency
+        else:
+            health.latency = 0.8 * health.latency + 0.2 * latency
+        health.failure_rate *= 0.8
+        health.consecutive_failures = 0
+
+    def record_failure(self, resolver):
+        health = self._resolvers[resolver]
+        health.failure_rate = 0.8 * health.failure_rate + 0.2
+        health.consecutive_failures += 1
+        if health.consecutive_failures >= RESOLVER_EJECTION_FAILURES:
+            health.ejected_until = time.monotonic() + RESOLVER_EJECTION_TIME
+            health.consecutive_failures = 0
@@ -0,0 +1,81 @@
+from .constants import (
+    INITIAL_QUERY_TIMEOUT,
+    MIN_QUERY_TIMEOUT,
+)
+
+
+class _ServerRTT:
+    __slots__ = ('srtt', 'rttvar', 'unresponsive')
+
+    def __init__(self):
+        # In seconds, None until the first answer
+        self.srtt = None
+        self.rttvar = None
+        # Set when every attempt at the last query timed out
+        self.unresponsive = False
+
+
+class RTTEstimator:
+    """
+    Keeps a smoothed round-trip time for each nameserver IP, the same way
+    TCP does (RFC 6298), to decide how long to wait for its answers.
+
+    Fast nameservers get short timeouts, so a lost packet is retried
+    quickly instead of being waited on for `max_timeout` seconds.
+    Nameservers which did not answer any attempt at their last query
+    only get a single attempt, until they answer again.
+    """
+
+    def __init__(self, max_timeout, max_attempts):
+        self.max_timeout = max_timeout
+        self.max_attempts = max_attempts
+        # Nameserver IP to _ServerRTT
+        self._servers = {}
+
+    def _get_server(self, nameserver_ip):
+        if nameserver_ip not in self._servers:
+            self._servers[nameserver_ip] = _ServerRTT()
+        return self._servers[nameserver_ip]
+
+    def get_attempts(self, nameserver_ip):
+        """
+        :returns: int
+        """
+        if self._get_server(nameserver_ip).unresponsive:
+            return 1
+        return self.max_attempts
+
+    def get_timeout(self, nameserver_ip, attempt):
+        """
+        :type attempt: int
+        Starting from 0, the timeout doubles for every retry
+
+        :returns: float
+        In seconds
+        """
+        server = self._get_server(nameserver_ip)
+        if server.srtt is None:
+            timeout = INITIAL_QUERY_TIMEOUT
+        else:
+            timeout = max(server.srtt + 4 * server.rttvar, MIN_QUERY_TIMEOUT)
+        return min(timeout * 2 ** attempt, self.max_timeout)
+
+    def record_answer(self, nameserver_ip, rtt):
+        """
+        :type rtt: float or None
+        In seconds, None if the answer may have been to an earlier
+        attempt, as its round-trip time is then unknown
+        """
+        server = self._get_server(nameserver_ip)
+        server.unresponsive = False
+        if rtt is None:
+            return
+        if server.srtt is None:
+            server.srtt = rtt
+            server.rttvar = rtt / 2
+        else:
+            server.rttvar = 0.75 * server.rttvar + 0.25 * abs(server.srtt - rtt)
+            server.srtt = 0.875 * server.srtt + 0.125 * rtt
+
+    def record_no_answer(self, nameserver_ip):
+        self._get_server(nameserver_ip).unresponsive = True
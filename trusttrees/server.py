@@ -0,0 +1,348 @@
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import urllib.parse
+from collections import deque
+from http import HTTPStatus
+
+from .constants import (
+    SERVE_MAX_FINISHED_JOBS,
+    SERVE_MAX_REQUEST_BYTES,
+)
+from .dns import enumerate_nameservers
+from .targets import normalize_target_hostname
+from .utils import (
+    clear_global_state,
+    get_findings,
+    get_results_record,
+    start_base_domain_checks,
+)
+
+
+class _HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _scan_job(target_hostname):
+    """
+    Runs in one of the ScanServer's threads. Each thread keeps its own
+    event loop, and so its sockets, address cache, rate limiter and
+    resolver health, from one job to the next.
+
+    :returns: dictionary
+    As returned by get_results_record()
+    """
+    clear_global_state()
+    enumerate_nameservers(target_hostname)
+    findings = get_findings(start_base_domain_checks())
+    return get_results_record(target_hostname, findings)
+
+
+class _Job:
+    __slots__ = ('id', 'target_hostname', 'priority', 'status', 'result', 'error', 'finished')
+
+    def __init__(self, job_id, target_hostname, priority):
+        self.id = job_id
+        self.target_hostname = target_hostname
+        self.priority = priority
+        # 'queued', 'running', 'done' or 'failed'
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        # Set once the job is done or failed
+        self.finished = asyncio.Event()
+
+    def to_dict(self):
+        job_dict = {
+            'id': self.id,
+            'target': self.target_hostname,
+            'priority': self.priority,
+            'status': self.status,
+        }
+        if self.result is not None:
+            job_dict['result'] = self.result
+        if self.error is not None:
+            job_dict['error'] = self.error
+        return job_dict
+
+
+class ScanServer:
+    """
+    Takes scan jobs over a local HTTP/JSON API, and runs them in `workers`
+    threads, which last as long as the server does. So unlike separate
+    runs, every job shares the referrals in global_state.DELEGATION_CACHE,
+    the domain checks already made, and each thread's lookups of
+    nameservers without glue.
+
+    Jobs with a higher priority are started first, and otherwise in the
+    order they were submitted. A target submitted again while it is still
+    queued shares the queued job.
+
+        POST /scans            {"targets": ["example.com", ...], "priority": 0}
+        GET  /scans/<job ID>
+        GET  /status
+
+    POST /scans and GET /scans/<job ID> take ?wait=SECONDS, to wait up to
+    that long for the jobs to finish. A finished job's "result" is what
+    --jsonl would write for the target.
+
+    Must only be used from the event loop it was created in.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix='trusttrees-scan',
+        )
+        # Of (-priority, job ID, _Job). A job whose priority was raised
+        # is queued again, and its first entry skipped
+        self._queue = asyncio.PriorityQueue()
+        self._job_ids = itertools.count(1)
+        # Job ID to _Job, for every job not yet forgotten
+        self._jobs = {}
+        # Target hostname to its _Job, while it is queued
+        self._queued_jobs = {}
+        # IDs of finished jobs, oldest first
+        self._finished_job_ids = deque()
+        self._running_jobs = 0
+
+    def submit(self, target_hostnames, priority):
+        """
+        :returns: list of _Job
+        """
+        jobs = []
+        for target_hostname in target_hostnames:
+            job = self._queued_jobs.get(target_hostname)
+            if job is None:
+                job = _Job(next(self._job_ids), target_hostname, priority)
+                self._jobs[job.id] = job
+                self._queued_jobs[target_hostname] = job
+                self._queue.put_nowait((-job.priority, job.id, job))
+            elif priority > job.priority:
+                job.priority = priority
+                self._queue.put_nowait((-job.priority, job.id, job))
+            jobs.append(job)
+        return jobs
+
+    def _forget_old_jobs(self, job):
+        self._finished_job_ids.append(job.id)
+        while len(self._finished_job_ids) > SERVE_MAX_FINISHED_JOBS:
+            del self._jobs[self._finished_job_ids.popleft()]
+
+    async def _run_jobs(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            negative_priority, _, job = await self._queue.get()
+            if (
+                job.status != 'queued'
+                or
+                -negative_priority != job.priority
+            ):
+                # Already taken at a higher priority
+                continue
+
+            del self._queued_jobs[job.target_hostname]
+            job.status = 'running'
+            self._running_jobs += 1
+            print(f'[ STATUS ] Starting job {job.id} for {job.target_hostname}')
+            try:
+                job.result = await loop.run_in_executor(
+                    self._executor,
+                    _scan_job,
+                    job.target_hostname,
+                )
+                job.status = 'done'
+            except Exception as e:
+                job.status = 'failed'
+                job.error = f'{type(e).__name__}: {e}'
+                print(f'[ ERROR ] Job {job.id} for {job.target_hostname} failed, {job.error}')
+            self._running_jobs -= 1
+            job.finished.set()
+            self._forget_old_jobs(job)
+
+    async def run_jobs(self):
+        """
+        Runs queued jobs forever, `workers` at a time
+        """
+        try:
+            await asyncio.gather(
+                *(
+                    self._run_jobs()
+                    for _ in range(self.workers)
+                )
+            )
+        finally:
+            self._executor.shutdown(wait=False)
+
+    @staticmethod
+    async def _wait_for_jobs(jobs, timeout):
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(
+                    *(
+                        job.finished.wait()
+                        for job in jobs
+                    )
+                ),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            pass
+
+    async def _handle_request(self, method, path, query, body):
+        """
+        :returns: tuple (HTTPStatus, JSON-serializable object)
+        """
+        wait = None
+        if 'wait' in query:
+            try:
+                wait = float(query['wait'][0])
+            except ValueError:
+                raise _HTTPError(HTTPStatus.BAD_REQUEST, 'wait must be a number of seconds')
+
+        if path == '/status':
+            if method != 'GET':
+                raise _HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, 'Use GET')
+            return (
+                HTTPStatus.OK,
+                {
+                    'workers': self.workers,
+                    'queued': len(self._queued_jobs),
+                    'running': self._running_jobs,
+                    'finished': len(self._finished_job_ids),
+                },
+            )
+
+        if path == '/scans':
+            if method != 'POST':
+                raise _HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, 'Use POST')
+            try:
+                request = json.loads(body)
+                target_hostnames = request['targets']
+                priority = request.get('priority', 0)
+            except (ValueError, TypeError, KeyError, AttributeError):
+                raise _HTTPError(
+                    HTTPStatus.BAD_REQUEST,
+                    'Expected a JSON object like {"targets": ["example.com"], "priority": 0}',
+                )
+            if (
+                not isinstance(target_hostnames, list)
+                or
+                not all(isinstance(target_hostname, str) for target_hostname in target_hostnames)
+                or
+                not isinstance(priority, int)
+            ):
+                raise _HTTPError(
+                    HTTPStatus.BAD_REQUEST,
+                    'targets must be a list of hostnames, and priority an integer',
+                )
+
+            jobs = self.submit(
+                [
+                    target_hostname
+                    for target_hostname in map(normalize_target_hostname, target_hostnames)
+                    if target_hostname
+                ],
+                priority,
+            )
+            if wait:
+                await self._wait_for_jobs(jobs, wait)
+            return (
+                HTTPStatus.ACCEPTED,
+                {'jobs': [job.to_dict() for job in jobs]},
+            )
+
+        if path.startswith('/scans/'):
+            if method != 'GET':
+                raise _HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, 'Use GET')
+            try:
+                job = self._jobs[int(path[len('/scans/'):])]
+            except (ValueError, KeyError):
+                raise _HTTPError(HTTPStatus.NOT_FOUND, 'No such job, or it was forgotten')
+            if wait:
+                await self._wait_for_jobs([job], wait)
+            return (HTTPStatus.OK, job.to_dict())
+
+        raise _HTTPError(HTTPStatus.NOT_FOUND, 'No such endpoint')
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answers one HTTP/1.1 request per connection
+        """
+        try:
+            try:
+                request_line = (await reader.readline()).decode('latin-1')
+                method, url, _ = request_line.split(' ', 2)
+                headers = {}
+                while True:
+                    header = (await reader.readline()).decode('latin-1')
+                    if header in ('\r\n', '\n', ''):
+                        break
+                    name, _, value = header.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                content_length = int(headers.get('content-length', 0))
+            except ValueError:
+                raise _HTTPError(HTTPStatus.BAD_REQUEST, 'Malformed HTTP request')
+            if content_length > SERVE_MAX_REQUEST_BYTES:
+                raise _HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Request body is too large')
+            body = await reader.readexactly(content_length)
+
+            url = urllib.parse.urlsplit(url)
+            status, response = await self._handle_request(
+                method,
+                url.path.rstrip('/'),
+                urllib.parse.parse_qs(url.query),
+                body,
+            )
+        except _HTTPError as e:
+            status, response = (e.status, {'error': str(e)})
+        except (
+            asyncio.IncompleteReadError,
+            ConnectionError,
+        ):
+            writer.close()
+            return
+
+        response = json.dumps(response).encode('utf-8')
+        writer.write(
+            (
+                f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                'Content-Type: application/json\r\n'
+                f'Content-Length: {len(response)}\r\n'
+                'Connection: close\r\n'
+                '\r\n'
+            ).encode('latin-1') + response,
+        )
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def _serve(host, port, workers):
+    scan_server = ScanServer(workers)
+    server = await asyncio.start_server(scan_server.handle_connection, host, port)
+    print(f'[ STATUS ] Serving scan jobs on http://{host}:{port}/ with {workers} worker(s)')
+    async with server:
+        await scan_server.run_jobs()
+
+
+def serve(address, workers):
+    """
+    Runs a ScanServer until interrupted
+
+    :type address: string
+    e.g.
+        "127.0.0.1:8053" or "[::1]:8053"
+    """
+    host, _, port = address.rpartition(':')
+    try:
+        asyncio.run(_serve(host.strip('[]') or '127.0.0.1', int(port), workers))
+    except KeyboardInterrupt:
+        print('[ STATUS ] Stopped serving')
@@ -0,0 +1,126 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class SQLiteCache:
+    """
+    A size-bounded key/value store in an SQLite file, shared by every
+    worker pointed at the same directory.
+
+    Values are stored as JSON, each with its own expiry time. The least
+    recently used entries are evicted once there are more than `max_entries`,
+    where an entry's last use is only updated every LAST_USED_RESOLUTION
+    seconds.
+    """
+
+    FILENAME = None
+    # Check the size bound after this many writes, rather than on every write
+    EVICTION_INTERVAL = 1000
+    # Seconds a hit may leave an entry's last_used stale, so most reads never write
+    LAST_USED_RESOLUTION = 3600
+
+    def __init__(self, cache_dir, max_entries):
+        self.path = os.path.join(cache_dir, self.FILENAME)
+        self.max_entries = max_entries
+        # sqlite3 connections can not be shared between threads
+        self._thread_local = threading.local()
+        self._writes_since_eviction = 0
+        # Workers in the same process share the counter
+        self._eviction_lock = threading.Lock()
+
+    def _get_connection(self):
+        if not hasattr(self._thread_local, 'connection'):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            # Concurrent workers write to the same file
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache (
+                    cache_key TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    value TEXT NOT NULL
+                )
+                """,
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used)',
+            )
+            connection.commit()
+            self._thread_local.connection = connection
+        return self._thread_local.connection
+
+    def get_value(self, cache_key):
+        """
+        :returns: the decoded JSON value, or None if missing or expired
+        """
+        connection = self._get_connection()
+        now = time.time()
+        row = connection.execute(
+            'SELECT expires_at, last_used, value FROM cache WHERE cache_key = ?',
+            (cache_key,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        expires_at, last_used, value = row
+        if expires_at <= now:
+            # Left for evict() to drop, so reads do not write
+            return None
+
+        if now - last_used > self.LAST_USED_RESOLUTION:
+            connection.execute(
+                'UPDATE cache SET last_used = ? WHERE cache_key = ?',
+                (now, cache_key),
+            )
+            connection.commit()
+        return json.loads(value)
+
+    def set_value(self, cache_key, value, ttl):
+        """
+        :type ttl: int
+        In seconds
+        """
+        connection = self._get_connection()
+        now = time.time()
+        connection.execute(
+            'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+            (cache_key, now + ttl, now, json.dumps(value)),
+        )
+        connection.commit()
+
+        with self._eviction_lock:
+            self._writes_since_eviction += 1
+            should_evict = self._writes_since_eviction >= self.EVICTION_INTERVAL
+            if should_evict:
+                self._writes_since_eviction = 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Drops expired entries, then the least recently used ones over `max_entries`
+        """
+        connection = self._get_connection()
+        connection.execute(
+            'DELETE FROM cache WHERE expires_at <= ?',
+            (time.time(),),
+        )
+        (num_entries,) = connection.execute(
+            'SELECT COUNT(*) FROM cache',
+        ).fetchone()
+        if num_entries > self.max_entries:
+            connection.execute(
+                """
+                DELETE FROM cache WHERE cache_key IN (
+                    SELECT cache_key FROM cache ORDER BY last_used LIMIT ?
+                )
+                """,
+                (num_entries - self.max_entries,),
+            )
+        connection.commit()
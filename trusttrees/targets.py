@@ -0,0 +1,129 @@
+import sqlite3
+
+from .constants import CHECKPOINT_COMMIT_INTERVAL
+
+
+def normalize_target_hostname(target_hostname):
+    """
+    :returns: string or None
+    Lowercase with a trailing '.', or None for a blank line
+    e.g.
+        "Example.com" -> "example.com."
+    """
+    target_hostname = target_hostname.strip().lower()
+    if not target_hostname:
+        return None
+    if not target_hostname.endswith('.'):
+        target_hostname += '.'
+    return target_hostname
+
+
+class TargetCheckpoint:
+    """
+    An SQLite file of every target read in a run, and which are done,
+    so an interrupted run can be resumed with --resume.
+
+    Targets are kept on disk rather than in memory, as lists can have
+    tens of millions of them. Writes are committed every
+    CHECKPOINT_COMMIT_INTERVAL changes, so after a crash the last few
+    targets finished may be scanned again.
+    """
+
+    def __init__(self, path, resume):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS targets ('
+            'hostname TEXT PRIMARY KEY, '
+            'run INTEGER NOT NULL, '
+            'done INTEGER NOT NULL DEFAULT 0'
+            ')'
+        )
+        if not resume:
+            self._connection.execute('DELETE FROM targets')
+        # Tells targets read in this run apart from ones read in an earlier run
+        (last_run,) = self._connection.execute(
+            'SELECT COALESCE(MAX(run), 0) FROM targets',
+        ).fetchone()
+        self._run = last_run + 1
+        self._connection.commit()
+        self._changes_since_commit = 0
+
+    def _changed(self):
+        self._changes_since_commit += 1
+        if self._changes_since_commit >= CHECKPOINT_COMMIT_INTERVAL:
+            self._connection.commit()
+            self._changes_since_commit = 0
+
+    def start(self, target_hostname):
+        """
+        :returns: bool
+        False if the target is already done, or was already read in this run
+        """
+        if self._connection.execute(
+            'INSERT OR IGNORE INTO targets (hostname, run) VALUES (?, ?)',
+            (target_hostname, self._run),
+        ).rowcount:
+            self._changed()
+            return True
+
+        run, done = self._connection.execute(
+            'SELECT run, done FROM targets WHERE hostname = ?',
+            (target_hostname,),
+        ).fetchone()
+        if (
+            done
+            or
+            run == self._run
+        ):
+            return False
+
+        self._connection.execute(
+            'UPDATE targets SET run = ? WHERE hostname = ?',
+            (self._run, target_hostname),
+        )
+        self._changed()
+        return True
+
+    def mark_done(self, target_hostname):
+        self._connection.execute(
+            'UPDATE targets SET done = 1 WHERE hostname = ?',
+            (target_hostname,),
+        )
+        self._changed()
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+
+def read_target_hostnames(lines, checkpoint=None):
+    """
+    Reads targets one at a time, so the whole list is never in memory.
+
+    :type lines: iterable of strings
+    e.g. an open file or sys.stdin
+
+    :type checkpoint: TargetCheckpoint
+    If given, targets already done are skipped. Either way, duplicates are
+    found on disk rather than in memory
+
+    :yields: string
+    Each target once, normalized by normalize_target_hostname()
+    """
+    own_checkpoint = checkpoint is None
+    if own_checkpoint:
+        # An empty path is a temporary SQLite file, deleted once closed
+        checkpoint = TargetCheckpoint('', resume=False)
+    try:
+        for line in lines:
+            target_hostname = normalize_target_hostname(line)
+            if target_hostname is None:
+                continue
+            if not checkpoint.start(target_hostname):
+                continue
+            yield target_hostname
+    finally:
+        if own_checkpoint:
+            checkpoint.close()
@@ -0,0 +1,172 @@
+import asyncio
+import random
+import socket
+import struct
+
+import dns.exception
+import dns.flags
+import dns.message
+
+from .constants import (
+    DNS_PORT,
+    MAX_IDLE_TCP_CONNECTIONS_PER_SERVER,
+)
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    """
+    Hands each datagram to the query waiting on its (ID, source IP)
+    """
+
+    def __init__(self, pending_queries, port):
+        # (query ID, nameserver IP) to (dns.message.Message, asyncio.Future)
+        self.pending_queries = pending_queries
+        self.port = port
+
+    def datagram_received(self, data, addr):
+        if len(data) < 2 or addr[1] != self.port:
+            return
+        (query_id,) = struct.unpack('!H', data[:2])
+        pending_query = self.pending_queries.get((query_id, addr[0]))
+        if pending_query is None:
+            return
+
+        query, response_future = pending_query
+        if response_future.done():
+            return
+        try:
+            response = dns.message.from_wire(data)
+        except dns.exception.DNSException as e:
+            response_future.set_exception(e)
+            return
+        if query.is_response(response):
+            response_future.set_result(response)
+
+
+class DNSTransport:
+    """
+    Sends pre-built dns.message queries straight to nameservers.
+
+    Every query from one event loop shares a single UDP socket per address
+    family, and responses are matched back to queries by ID and source IP.
+    Truncated responses are retried over TCP, reusing idle connections to
+    the same nameserver.
+
+    Must only be used from the event loop it was created in.
+    """
+
+    def __init__(self, port=DNS_PORT):
+        self.port = port
+        # Address family to asyncio.DatagramTransport
+        self._udp_transports = {}
+        self._pending_queries = {}
+        # Nameserver IP to a list of idle (asyncio.StreamReader, asyncio.StreamWriter)
+        self._idle_tcp_connections = {}
+
+    async def _get_udp_transport(self, nameserver_ip):
+        family = socket.AF_INET6 if ':' in nameserver_ip else socket.AF_INET
+        if family not in self._udp_transports:
+            transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _UDPProtocol(self._pending_queries, self.port),
+                family=family,
+            )
+            self._udp_transports[family] = transport
+        return self._udp_transports[family]
+
+    async def _udp_exchange(self, query, nameserver_ip, timeout):
+        udp_transport = await self._get_udp_transport(nameserver_ip)
+
+        # Query IDs only have to be unique per nameserver
+        while (query.id, nameserver_ip) in self._pending_queries:
+            query.id = random.randint(0, 0xffff)
+        key = (query.id, nameserver_ip)
+        response_future = asyncio.get_running_loop().create_future()
+        self._pending_queries[key] = (query, response_future)
+        try:
+            udp_transport.sendto(query.to_wire(), (nameserver_ip, self.port))
+            return await asyncio.wait_for(response_future, timeout=timeout)
+        finally:
+            del self._pending_queries[key]
+
+    async def _tcp_exchange_on_connection(self, query, reader, writer):
+        wire = query.to_wire()
+        writer.write(struct.pack('!H', len(wire)) + wire)
+        await writer.drain()
+        (response_length,) = struct.unpack('!H', await reader.readexactly(2))
+        response = dns.message.from_wire(await reader.readexactly(response_length))
+        if not query.is_response(response):
+            raise dns.exception.FormError('TCP response does not match the query')
+        return response
+
+    async def _tcp_exchange(self, query, nameserver_ip, timeout):
+        idle_connections = self._idle_tcp_connections.setdefault(nameserver_ip, [])
+        while idle_connections:
+            reader, writer = idle_connections.pop()
+            try:
+                response = await asyncio.wait_for(
+                    self._tcp_exchange_on_connection(query, reader, writer),
+                    timeout=timeout,
+                )
+            except (asyncio.TimeoutError, EOFError, OSError):
+                # The nameserver probably closed the idle connection
+                writer.close()
+                continue
+            self._release_tcp_connection(nameserver_ip, reader, writer)
+            return response
+
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(nameserver_ip, self.port),
+            timeout=timeout,
+        )
+        try:
+            response = await asyncio.wait_for(
+                self._tcp_exchange_on_connection(query, reader, writer),
+                timeout=timeout,
+            )
+        except BaseException:
+            writer.close()
+            raise
+        self._release_tcp_connection(nameserver_ip, reader, writer)
+        return response
+
+    def _release_tcp_connection(self, nameserver_ip, reader, writer):
+        idle_connections = self._idle_tcp_connections[nameserver_ip]
+        if (
+            len(idle_connections) < MAX_IDLE_TCP_CONNECTIONS_PER_SERVER
+            and
+            not reader.at_eof()
+        ):
+            idle_connections.append((reader, writer))
+        else:
+            writer.close()
+
+    async def query(self, query, nameserver_ip, timeout):
+        """
+        Sends the query once, retries are up to the caller, see _dns_query() in dns.py
+
+        :type query: dns.message.Message
+        :type timeout: float
+        Seconds to wait for each of the UDP and, if truncated, TCP exchanges
+
+        Raises dns.exception.Timeout if it was not answered in time,
+        and dns.exception.DNSException for malformed responses.
+
+        :returns: dns.message.Message
+        """
+        try:
+            response = await self._udp_exchange(query, nameserver_ip, timeout)
+            if response.flags & dns.flags.TC:
+                # Response truncated; retry with TCP
+                response = await self._tcp_exchange(query, nameserver_ip, timeout)
+        except asyncio.TimeoutError:
+            raise dns.exception.Timeout()
+        return response
+
+    def close(self):
+        for udp_transport in self._udp_transports.values():
+            udp_transport.close()
+        self._udp_transports = {}
+        for idle_connections in self._idle_tcp_connections.values():
+            for _, writer in idle_connections:
+                writer.close()
+        self._idle_tcp_connections = {}
@@ -1,5 +1,29 @@
 import argparse
 
+from .constants import (
+    DEFAULT_MAX_IN_FLIGHT_QUERIES,
+    DEFAULT_MAX_QUERIES_PER_SECOND,
+    DEFAULT_MAX_QUERIES_PER_SERVER_PER_SECOND,
+    DEFAULT_QUERY_ATTEMPTS,
+    DEFAULT_QUERY_CACHE_MAX_ENTRIES,
+    DEFAULT_QUERY_TIMEOUT,
+    DNS_PORT,
+)
+
+
+def _positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, not {value}')
+    return number
+
+
+def _positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f'must be more than 0, not {value}')
+    return number
+
 
 def _add_mutually_exclusive_required_args(parser):
     required_group = parser.add_mutually_exclusive_group(required=True)
@@ -13,7 +37,13 @@ def _add_mutually_exclusive_required_args(parser):
         '-l',
         '--target-list',
         dest='target_hostnames_list',
-        help='Text file with a list of target hostnames.',
+        help='Text file with a list of target hostnames, or - to read them from stdin.',
+    )
+    required_group.add_argument(
+        '--serve',
+        dest='serve_address',
+        help='Take scan jobs over a local HTTP/JSON API instead, e.g: --serve 127.0.0.1:8053',
+        metavar='HOST:PORT',
     )
     parser.add_argument(
         '-h',
@@ -46,6 +76,32 @@ def _add_optional_args(parser):
         action='store_true',
     )
 
+    optional_group.add_argument(
+        '--checkpoint',
+        dest='checkpoint',
+        help='File to record which targets are done in, so the run can be resumed.',
+        metavar='CHECKPOINT_FILE',
+    )
+    optional_group.add_argument(
+        '--resume',
+        dest='resume',
+        help='Skip the targets --checkpoint says are done, and append to --jsonl.',
+        action='store_true',
+    )
+    optional_group.add_argument(
+        '--incremental',
+        dest='incremental',
+        help='Only walk, and report, targets whose delegation changed since the last run.',
+        metavar='FINGERPRINTS_FILE',
+    )
+
+    optional_group.add_argument(
+        '--jsonl',
+        dest='jsonl',
+        help="Write each target's results to a JSON-lines file, as soon as they are ready.",
+        metavar='RESULTS_FILE',
+    )
+
     optional_group.add_argument(
         '-x',
         '--export-formats',
@@ -54,6 +110,15 @@ def _add_optional_args(parser):
         default='png',
     )
 
+    optional_group.add_argument(
+        '--render-workers',
+        dest='render_workers',
+        help='Number of processes to render graphs in, in the background of scanning.',
+        type=int,
+        default=0,
+        metavar='NUM_WORKERS',
+    )
+
     optional_group.add_argument(
         '-u',
         '--upload-graph',
@@ -68,10 +133,105 @@ def _add_optional_args(parser):
         help='Text file containing DNS resolvers to use.',
         metavar='RESOLVERS_FILE',
     )
+    optional_group.add_argument(
+        '--root-servers',
+        dest='root_servers',
+        help='Text file of "hostname IP" lines to start walks from, instead of the root servers.',
+        metavar='ROOT_SERVERS_FILE',
+    )
+    optional_group.add_argument(
+        '--dns-port',
+        dest='dns_port',
+        help='Port to send every DNS query to.',
+        type=int,
+        default=DNS_PORT,
+        metavar='PORT',
+    )
+    optional_group.add_argument(
+        '--ipv6',
+        dest='ipv6',
+        help='Also look up and query the IPv6 addresses of nameservers.',
+        action='store_true',
+    )
+    optional_group.add_argument(
+        '--max-in-flight',
+        dest='max_in_flight_queries',
+        help='Maximum number of DNS queries to have in-flight at once.',
+        type=_positive_int,
+        default=DEFAULT_MAX_IN_FLIGHT_QUERIES,
+        metavar='NUM_QUERIES',
+    )
+    optional_group.add_argument(
+        '--query-timeout',
+        dest='query_timeout',
+        help='Most seconds to wait for each attempt at a DNS query, fast nameservers get less.',
+        type=float,
+        default=DEFAULT_QUERY_TIMEOUT,
+        metavar='SECONDS',
+    )
+    optional_group.add_argument(
+        '--query-attempts',
+        dest='query_attempts',
+        help='Number of times to send a DNS query before recording a TIMEOUT.',
+        type=_positive_int,
+        default=DEFAULT_QUERY_ATTEMPTS,
+        metavar='NUM_ATTEMPTS',
+    )
+    optional_group.add_argument(
+        '--max-qps',
+        dest='max_queries_per_second',
+        help='Maximum number of DNS queries to send per second, across all workers.',
+        type=_positive_float,
+        default=DEFAULT_MAX_QUERIES_PER_SECOND,
+        metavar='NUM_QUERIES',
+    )
+    optional_group.add_argument(
+        '--max-qps-per-server',
+        dest='max_queries_per_server_per_second',
+        help='Maximum number of DNS queries to send to each nameserver per second.',
+        type=_positive_float,
+        default=DEFAULT_MAX_QUERIES_PER_SERVER_PER_SECOND,
+        metavar='NUM_QUERIES',
+    )
+    optional_group.add_argument(
+        '--workers',
+        dest='workers',
+        help='Number of targets to scan in parallel, e.g: --workers 8',
+        type=int,
+        default=1,
+        metavar='NUM_WORKERS',
+    )
+    optional_group.add_argument(
+        '--worker-backend',
+        dest='worker_backend',
+        help='Run workers as separate processes or as threads, --serve always uses threads.',
+        choices=('process', 'thread'),
+        default='process',
+    )
+    optional_group.add_argument(
+        '--cache-dir',
+        dest='cache_dir',
+        help='Directory to save DNS and domain-check results in, to reuse them in later runs.',
+        metavar='CACHE_DIR',
+    )
+    optional_group.add_argument(
+        '--cache-max-entries',
+        dest='cache_max_entries',
+        help='Maximum number of DNS query results to keep in --cache-dir.',
+        type=int,
+        default=DEFAULT_QUERY_CACHE_MAX_ENTRIES,
+        metavar='NUM_ENTRIES',
+    )
 
     optional_domain_checking_group = parser.add_argument_group(
         title='optional arguments for domain-checking',
     )
+    optional_domain_checking_group.add_argument(
+        '--public-suffix-list',
+        dest='public_suffix_list',
+        help='Public Suffix List file to find base domains with, instead of the bundled snapshot.',
+        metavar='PSL_FILE',
+    )
     optional_domain_checking_group.add_argument(
         '--aws-credentials',
         dest='aws_creds_filepath',
@@ -114,4 +274,11 @@ def parse_args(args):
 
     _add_optional_args(parser)
 
-    return parser.parse_args()
+    parsed_args = parser.parse_args()
+    if (
+        parsed_args.resume
+        and
+        not parsed_args.checkpoint
+    ):
+        parser.error('--resume requires --checkpoint')
+    return parsed_args
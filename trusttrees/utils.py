@@ -1,23 +1,27 @@
 import errno
+import json
 import os
-from collections import defaultdict
-
-import tldextract
 
 from . import global_state
-from .constants import DNS_WATCH_RESOLVER
-from .registar_checking import is_domain_available
+from .availability_cache import AvailabilityCache
+from .constants import (
+    AVAILABILITY_CACHE_AVAILABLE_TTL,
+    AVAILABILITY_CACHE_MAX_ENTRIES,
+    AVAILABILITY_CACHE_REGISTERED_TTL,
+    DNS_WATCH_RESOLVER,
+    QUERY_CACHE_NEGATIVE_TTL,
+)
+from .fingerprint_store import FingerprintStore
+from .public_suffix import get_base_domain
+from .query_cache import QueryCache
+from .registar_checking import start_availability_checks
 
 
 def clear_global_state():
     """
     See global_state.py for more information
     """
-    global_state.PREVIOUS_EDGES = set()
-    global_state.MASTER_DNS_CACHE = {}
-    global_state.NS_IP_MAP = defaultdict(str)
-    global_state.AUTHORITATIVE_NS_LIST = []
-    global_state.QUERY_ERROR_LIST = []
+    global_state.set_scan_state(global_state.ScanState())
 
 
 def create_output_dir():
@@ -28,35 +32,50 @@ def create_output_dir():
             raise
 
 
-def _get_base_domain(input_hostname):
+def start_base_domain_checks():
     """
-    :type input_hostname: string
-    e.g.
-        "ns2.foo.com."
+    Starts checking the base domains of the current target's nameservers,
+    without waiting for the results.
 
-    :returns: string
+    :returns: list of tuples (string, string, concurrent.futures.Future)
     e.g.
-        foo.com.
+        [("foo.com.", "ns2.foo.com.", <Future of bool>), ...]
     """
-    tldexact_parts = tldextract.extract(f'http://{input_hostname}')
-    return f'{tldexact_parts.domain}.{tldexact_parts.suffix}.'
+    if not global_state.CHECK_DOMAIN_AVAILABILITY:
+        return []
 
-
-def get_available_base_domains():
+    ns_hostname_to_base_domain = {}
+    for ns_hostname in global_state.NS_IP_MAP:
+        base_domain = get_base_domain(ns_hostname)
+        # e.g. a nameserver named after a public suffix has no base domain to register
+        if base_domain:
+            ns_hostname_to_base_domain[ns_hostname] = base_domain
+    # Check every base domain in one batch
+    base_domain_checks = start_availability_checks(
+        ns_hostname_to_base_domain.values(),
+    )
+    return [
+        (base_domain, ns_hostname, base_domain_checks[base_domain])
+        for ns_hostname, base_domain in ns_hostname_to_base_domain.items()
+    ]
+
+
+def get_available_base_domains(base_domain_checks=None):
     """
     This can mean the domain can be registered and the DNS hijacked!
 
+    :type base_domain_checks: list
+    As returned by start_base_domain_checks(), which is called if not given
+
     :yields: tuple (string, string)
     e.g.
         ("foo.com.", "ns2.foo.com.")
     """
-    for ns_hostname in global_state.NS_IP_MAP:
-        base_domain = _get_base_domain(ns_hostname)
-        if (
-            global_state.CHECK_DOMAIN_AVAILABILITY
-            and
-            is_domain_available(base_domain)
-        ):
+    if base_domain_checks is None:
+        base_domain_checks = start_base_domain_checks()
+
+    for base_domain, ns_hostname, is_available in base_domain_checks:
+        if is_available.result():
             yield (base_domain, ns_hostname)
 
 
@@ -67,11 +86,81 @@ def get_nameservers_with_no_ip():
     :yields: string
     Nameserver hostnames
     """
-    for ns_hostname, ns_hostname_ip in global_state.NS_IP_MAP.items():
-        if not ns_hostname_ip:
+    for ns_hostname, ns_hostname_ips in global_state.NS_IP_MAP.items():
+        if not ns_hostname_ips:
             yield ns_hostname
 
 
+def get_findings(base_domain_checks=None):
+    """
+    Everything about the current target that is likely to be vulnerable,
+    worked out straight from global_state without building a graph.
+
+    :type base_domain_checks: list
+    As returned by start_base_domain_checks(), which is called if not given
+
+    :returns: dictionary
+    e.g.
+        {
+            "nameservers_with_no_ip": ["ns2.foo.com."],
+            "available_base_domains": [("foo.com.", "ns2.foo.com.")],
+        }
+    """
+    return {
+        'nameservers_with_no_ip': list(get_nameservers_with_no_ip()),
+        'available_base_domains': list(get_available_base_domains(base_domain_checks)),
+    }
+
+
+def get_results_record(target_hostname, findings, changes=None):
+    """
+    Everything found about the current target, for JSON
+
+    :type findings: dictionary
+    As returned by get_findings()
+
+    :type changes: list of dictionaries or None
+    With --incremental, as returned by update_fingerprint() in incremental.py
+
+    :returns: dictionary
+    """
+    results_record = {
+        'target': target_hostname,
+        'ns_results': {
+            cache_key: ns_result.to_dict()
+            for cache_key, ns_result in global_state.MASTER_DNS_CACHE.items()
+        },
+        'nameservers_with_no_ip': findings['nameservers_with_no_ip'],
+        'available_base_domains': findings['available_base_domains'],
+        'query_errors': global_state.QUERY_ERROR_LIST,
+    }
+    if changes is not None:
+        results_record['changes'] = changes
+    return results_record
+
+
+def write_results_record(results_file, target_hostname, findings, changes=None):
+    """
+    Writes get_results_record() as one line of JSON,
+    so results can be read while a long run is still going.
+
+    :type results_file: file object
+    Opened for writing text
+    """
+    results_file.write(
+        json.dumps(get_results_record(target_hostname, findings, changes)) + '\n',
+    )
+    results_file.flush()
+
+
+def is_problematic(findings):
+    """
+    :type findings: dictionary
+    As returned by get_findings()
+    """
+    return any(findings.values())
+
+
 def is_authoritative(flags):
     return 'AA' in flags
 
@@ -99,8 +188,50 @@ def set_global_state_with_args(args):
         global_state.DNSIMPLE_ACCESS_TOKEN = args.dnsimple_api_v2_token
     else:
         global_state.CHECK_DOMAIN_AVAILABILITY = False
-
-    # To use a random resolver every time
+    global_state.PUBLIC_SUFFIX_LIST = args.public_suffix_list
+
+    # For the DNS walk in enumerate_nameservers()
+    global_state.IPV6_ENABLED = args.ipv6
+    global_state.MAX_IN_FLIGHT_QUERIES = args.max_in_flight_queries
+    global_state.QUERY_TIMEOUT = args.query_timeout
+    global_state.QUERY_ATTEMPTS = args.query_attempts
+    # Each worker has its own rate limiter
+    global_state.MAX_QUERIES_PER_SECOND = args.max_queries_per_second / max(args.workers, 1)
+    global_state.MAX_QUERIES_PER_SERVER_PER_SECOND = (
+        args.max_queries_per_server_per_second / max(args.workers, 1)
+    )
+    if args.cache_dir:
+        global_state.QUERY_CACHE = QueryCache(
+            cache_dir=args.cache_dir,
+            max_entries=args.cache_max_entries,
+            negative_ttl=QUERY_CACHE_NEGATIVE_TTL,
+        )
+        global_state.AVAILABILITY_CACHE = AvailabilityCache(
+            cache_dir=args.cache_dir,
+            max_entries=AVAILABILITY_CACHE_MAX_ENTRIES,
+            registered_ttl=AVAILABILITY_CACHE_REGISTERED_TTL,
+            available_ttl=AVAILABILITY_CACHE_AVAILABLE_TTL,
+        )
+    if args.incremental:
+        global_state.FINGERPRINT_STORE = FingerprintStore(args.incremental)
+
+    if args.root_servers:
+        with open(args.root_servers) as root_servers:
+            global_state.ROOT_SERVERS = tuple(
+                {
+                    'hostname': hostname if hostname.endswith('.') else hostname + '.',
+                    'ip': ip,
+                }
+                for hostname, ip in (
+                    line.split()
+                    for line in root_servers.read().splitlines()
+                    if line.strip()
+                )
+            )
+    global_state.DNS_PORT = args.dns_port
+
+    # Each lookup goes to the better of two random resolvers, by latency and failures, see
+    # resolver_pool.py
     if args.resolvers:
         with open(args.resolvers) as resolvers:
             global_state.RESOLVERS = [
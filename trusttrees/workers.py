@@ -0,0 +1,126 @@
+import concurrent.futures
+
+from . import global_state
+from .dns import enumerate_nameservers
+from .incremental import is_unchanged_since_last_scan
+from .utils import (
+    clear_global_state,
+    set_global_state_with_args,
+)
+
+
+WORKER_BACKEND_TO_EXECUTOR = {
+    'process': concurrent.futures.ProcessPoolExecutor,
+    'thread': concurrent.futures.ThreadPoolExecutor,
+}
+# How many targets or graphs each worker may have queued up, to bound memory use
+PENDING_TARGETS_PER_WORKER = 2
+
+
+def _initialize_worker(args):
+    """
+    Worker processes do not necessarily inherit the parent's global_state
+    """
+    set_global_state_with_args(args)
+
+
+def _scan_target(target_hostname):
+    """
+    :returns: tuple (string, global_state.ScanState or None)
+    None if --incremental found the target unchanged
+    """
+    if (
+        global_state.FINGERPRINT_STORE
+        and
+        is_unchanged_since_last_scan(target_hostname)
+    ):
+        return (target_hostname, None)
+    clear_global_state()
+    enumerate_nameservers(target_hostname)
+    return (target_hostname, global_state.get_scan_state())
+
+
+def _scan_targets_with_pool(target_hostnames, args):
+    if args.worker_backend == 'process':
+        executor_kwargs = {
+            'initializer': _initialize_worker,
+            'initargs': (args,),
+        }
+    else:
+        # Threads share the main thread's global_state, caches included, and
+        # make their own ScanState, event loop and connections on first use
+        executor_kwargs = {}
+    with WORKER_BACKEND_TO_EXECUTOR[args.worker_backend](
+        max_workers=args.workers,
+        **executor_kwargs,
+    ) as executor:
+        max_pending = args.workers * PENDING_TARGETS_PER_WORKER
+        pending = set()
+        for target_hostname in target_hostnames:
+            pending.add(executor.submit(_scan_target, target_hostname))
+            if len(pending) < max_pending:
+                continue
+            done, pending = concurrent.futures.wait(
+                pending,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                yield future.result()
+
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+
+def scan_targets(target_hostnames, args):
+    """
+    Enumerates the nameservers of every target, spread across
+    `args.workers` workers when there is more than one.
+
+    Results are yielded as soon as each target finishes, not in order.
+
+    :yields: tuple (string, global_state.ScanState or None)
+    None if --incremental found the target unchanged, and so did not walk it.
+    Install the ScanState with global_state.set_scan_state() before graphing
+    """
+    if args.workers <= 1:
+        for target_hostname in target_hostnames:
+            yield _scan_target(target_hostname)
+        return
+
+    yield from _scan_targets_with_pool(target_hostnames, args)
+
+
+def create_render_pool(args):
+    """
+    Graphviz runs in these processes, so the next targets can be
+    scanned while the current graph is laid out.
+
+    :returns: concurrent.futures.ProcessPoolExecutor or None
+    None if graphs should be rendered inline
+    """
+    if args.no_graphing or args.render_workers <= 0:
+        return None
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.render_workers,
+        initializer=_initialize_worker,
+        initargs=(args,),
+    )
+
+
+def wait_for_renders(pending_renders, max_pending):
+    """
+    Waits until at most `max_pending` renders are left, re-raising any render errors.
+
+    :type pending_renders: set of concurrent.futures.Future
+
+    :returns: set of concurrent.futures.Future
+    The renders still pending
+    """
+    while len(pending_renders) > max_pending:
+        done, pending_renders = concurrent.futures.wait(
+            pending_renders,
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        for future in done:
+            future.result()
+    return pending_renders